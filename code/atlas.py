@@ -0,0 +1,60 @@
+import json
+
+from settings import *
+from os.path import join, relpath
+from os import walk, makedirs
+
+# Offline step: packs the animation folders into a few sheets, run it from the code folder
+# The tilesets, map and objects folders are left out, the maps load those images themselves
+ATLAS_FOLDERS = SHARED_IMAGE_FOLDERS
+SHEET_SIZE = 2048
+PADDING = 1
+
+
+def pack(images):
+    # Shelf packing: tallest images first, left to right, a new shelf when the row is full
+    placements, sheet_sizes = {}, []
+    x = y = shelf_height = 0
+    for name, surf in sorted(images.items(), key = lambda item: item[1].get_height(), reverse = True):
+        width, height = surf.get_size()
+        if x + width > SHEET_SIZE:
+            x, y, shelf_height = 0, y + shelf_height + PADDING, 0
+        if not sheet_sizes or y + height > SHEET_SIZE or width > SHEET_SIZE:
+            x = y = shelf_height = 0
+            sheet_sizes.append((max(width, SHEET_SIZE), height))
+        placements[name] = (len(sheet_sizes) - 1, x, y)
+        x += width + PADDING
+        shelf_height = max(shelf_height, height)
+        sheet_sizes[-1] = (sheet_sizes[-1][0], max(sheet_sizes[-1][1], y + height))  # Only as tall as needed
+    return placements, sheet_sizes
+
+
+def build_atlas(graphics_path, output_path):
+    images, folders = {}, {}
+    for atlas_folder in ATLAS_FOLDERS:
+        for folder_path, sub_folders, file_names in walk(join(graphics_path, atlas_folder)):
+            image_names = [name for name in file_names if name.endswith('.png')]
+            folders[relpath(folder_path, graphics_path).replace('\\', '/')] = (sorted(sub_folders), image_names)
+            for image_name in image_names:
+                name = relpath(join(folder_path, image_name), graphics_path).replace('\\', '/')
+                images[name] = pygame.image.load(join(folder_path, image_name))
+
+    placements, sheet_sizes = pack(images)
+    sheets = [pygame.Surface(size, pygame.SRCALPHA) for size in sheet_sizes]
+    frames = {}
+    for name, (sheet, x, y) in placements.items():
+        sheets[sheet].blit(images[name], (x, y))
+        frames[name] = [sheet, x, y, *images[name].get_size()]
+
+    makedirs(output_path, exist_ok = True)
+    sheet_names = [f'{index}.png' for index in range(len(sheets))]
+    for sheet, sheet_name in zip(sheets, sheet_names):
+        pygame.image.save(sheet, join(output_path, sheet_name))
+    with open(join(output_path, 'atlas.json'), 'w') as file:
+        json.dump({'sheets': sheet_names, 'frames': frames, 'folders': folders}, file)
+    return len(images), len(sheets)
+
+
+if __name__ == '__main__':
+    image_count, sheet_count = build_atlas(join('..', 'graphics'), join('..', 'graphics', 'atlas'))
+    print(f'Packed {image_count} images into {sheet_count} sheets')
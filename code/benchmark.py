@@ -0,0 +1,172 @@
+import json
+
+from settings import *
+from main import Game
+from level import Level
+from overworld import Overworld
+from controls import controls, ScriptedInput
+from replay import percentile
+from timer import scheduler
+from map_cache import load_map
+from time import perf_counter
+from random import seed
+from argparse import ArgumentParser
+
+# Headless timings of every map, run from the code folder:
+#   python benchmark.py --output before.json
+#   python benchmark.py --baseline before.json
+LEVEL_PHASES = ['update', 'pearl_collision', 'boulet_collision', 'hit_collision', 'item_collision', 'attack_collision', 'draw']
+OVERWORLD_PHASES = ['update', 'draw']
+MIN_SLOWDOWN = 0.05  # In ms, smaller differences are noise
+
+
+def level_script(tick):
+    # Run right, then back left for a while, jumping and attacking
+    keys = [pygame.K_RIGHT if tick // 120 % 3 != 2 else pygame.K_LEFT]
+    if tick % 45 < 10:
+        keys.append(pygame.K_SPACE)
+    if tick % 60 == 30:
+        keys.append(pygame.K_f)
+    return keys
+
+
+def stats(times):
+    times = sorted(times)
+    return {
+        'runs': len(times),
+        'mean': sum(times) / len(times),
+        'p50': percentile(times, 0.5),
+        'p95': percentile(times, 0.95),
+        'p99': percentile(times, 0.99),
+        'max': times[-1],
+    }
+
+
+class Timings:
+    def __init__(self):
+        self.times = {}  # name -> durations in ms
+
+    def measure(self, name, func, *args):
+        start = perf_counter()
+        result = func(*args)
+        self.times.setdefault(name, []).append((perf_counter() - start) * 1000)
+        return result
+
+    def wrap(self, obj, method_name, name = None):
+        # Times every call of obj.method_name, the callers don't change
+        method = getattr(obj, method_name)
+        setattr(obj, method_name, lambda *args: self.measure(name or method_name, method, *args))
+
+    def results(self):
+        return {name: stats(times) for name, times in self.times.items()}
+
+
+def run_ticks(stage, timings, ticks, phases, exits):
+    # The game loop of Game.step, with each phase timed
+    for name in phases:
+        owner = stage.all_sprites if name in ('update', 'draw') else stage
+        timings.wrap(owner, name)
+    for _ in range(ticks):
+        start = perf_counter()
+        scheduler.update()
+        controls.tick()
+        stage.update(1 / TICK_RATE)
+        stage.draw()
+        timings.times.setdefault('frame', []).append((perf_counter() - start) * 1000)
+
+        # Back to the start each time the player falls or reaches the flag
+        if exits:
+            exits.clear()
+            stage.reset()
+
+
+def benchmark_level(game, key, builds, ticks):
+    timings = Timings()
+    tmx_map = timings.measure('load', load_map, game.tmx_maps.paths[key])
+    exits = []  # Instead of leaving for the overworld
+    for _ in range(builds):
+        level = timings.measure('build', Level, tmx_map, game.level_frames, game.data, lambda target, unlock = 0: exits.append(unlock))
+    controls.provider = ScriptedInput(level_script)
+    run_ticks(level, timings, ticks, LEVEL_PHASES, exits)
+    return timings.results()
+
+
+def benchmark_overworld(game, builds, ticks):
+    timings = Timings()
+    for _ in range(builds):
+        overworld = timings.measure('build', Overworld, game.tmx_overworld, game.data, game.overworld_frames, lambda *args: None)
+    controls.provider = ScriptedInput(lambda tick: ())  # The icon stays on its node
+    run_ticks(overworld, timings, ticks, OVERWORLD_PHASES, [])
+    return timings.results()
+
+
+def run_benchmark(maps, builds, ticks):
+    seed(0)
+    timings = Timings()
+    timings.wrap(Game, 'import_assets')
+    game = timings.measure('startup', Game, True)
+    maps = maps or list(game.tmx_maps.paths) + ['overworld']  # Every level and the overworld by default
+    results = {
+        'settings': {'tick_rate': TICK_RATE, 'ticks': ticks, 'builds': builds,
+                     'viewport_culling': VIEWPORT_CULLING, 'static_chunks': STATIC_CHUNKS},
+        'startup': timings.results(),
+        'maps': {},
+    }
+    for key in maps:
+        seed(0)
+        try:
+            if key == 'overworld':
+                results['maps'][key] = benchmark_overworld(game, builds, ticks)
+            else:
+                results['maps'][key] = benchmark_level(game, key, builds, ticks)
+        except Exception as error:  # A broken map shouldn't hide the others
+            results['maps'][key] = {'error': repr(error)}
+    return results
+
+
+def compare(results, baseline, threshold):
+    # Phases whose p95 got slower than the baseline by more than the threshold (and than the noise)
+    regressions = []
+    for key, phases in results['maps'].items():
+        for name, phase in phases.items():
+            base_phase = baseline['maps'].get(key, {}).get(name)
+            if name == 'error' or not isinstance(base_phase, dict):
+                continue
+            change = phase['p95'] / base_phase['p95'] - 1 if base_phase['p95'] else 0
+            flag = 'SLOWER' if change > threshold and phase['p95'] - base_phase['p95'] > MIN_SLOWDOWN else ''
+            print(f'{key:>10} {name:<18} p95 {base_phase["p95"]:8.3f} -> {phase["p95"]:8.3f} ms {change:+7.1%} {flag}')
+            if flag:
+                regressions.append((key, name, change))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--maps', nargs = '*', help = 'level keys (0, 1, omni...) and/or overworld, all of them by default')
+    parser.add_argument('--ticks', type = int, default = 600)
+    parser.add_argument('--builds', type = int, default = 5, help = 'times each level is built')
+    parser.add_argument('--output', metavar = 'FILE', help = 'save the results as json, printed otherwise')
+    parser.add_argument('--baseline', metavar = 'FILE', help = 'results to compare with, exits with 1 on a regression')
+    parser.add_argument('--threshold', type = float, default = 0.1, help = 'allowed p95 slowdown, 0.1 = 10%%')
+    args = parser.parse_args()
+
+    # Same keys as Game.tmx_maps: 0 for 0.tmx, 'omni' for omni.tmx
+    maps = [int(key) if key.isdigit() else key for key in args.maps or ()]
+
+    results = run_benchmark(maps, args.builds, args.ticks)
+    results['maps'] = {str(key): phases for key, phases in results['maps'].items()}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent = 2)
+    else:
+        print(json.dumps(results, indent = 2))
+
+    for key, phases in results['maps'].items():
+        if 'error' in phases:
+            print(f'{key}: {phases["error"]}')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
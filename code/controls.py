@@ -0,0 +1,44 @@
+from settings import *
+
+
+# Providers give the keys held during a tick, read once per tick by Controls
+class Keyboard:
+    def read(self):
+        return pygame.key.get_pressed()
+
+
+class KeyState:
+    # Indexed like pygame.key.get_pressed()
+    def __init__(self, held):
+        self.held = held
+
+    def __getitem__(self, key):
+        return key in self.held
+
+
+class ScriptedInput:
+    def __init__(self, script):
+        # script(tick) gives the keys held during that tick
+        self.script = script
+        self.tick = 0
+
+    def read(self):
+        keys = KeyState(set(self.script(self.tick)))
+        self.tick += 1
+        return keys
+
+
+class Controls:
+    def __init__(self):
+        self.provider = Keyboard()
+        self.keys = KeyState(())
+
+    def tick(self):
+        # Everything read during a tick sees the same keys, whatever the provider
+        self.keys = self.provider.read()
+
+    def get_pressed(self):
+        return self.keys
+
+
+controls = Controls()  # Read by the player and the overworld, swapped for simulations
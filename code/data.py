@@ -2,9 +2,13 @@ class Data:
     def __init__(self, ui):
         # UI
         self.ui = ui
+        self.reset()
+
+    def reset(self):
+        # Back to the start of a game
         self._coins = 0
         self._health = 500  #Underscore means private attribute
-        self.ui.create_hearts(self._health)
+        self.ui.show_health(self._health)
 
         # Overworld
         self.unlocked_level = 5
@@ -29,6 +33,6 @@ class Data:
     @health.setter
     def health(self, value):
         self._health = value
-        self.ui.create_hearts(self.health)
+        self.ui.show_health(self.health)
 
 
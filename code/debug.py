@@ -1,4 +1,9 @@
 import pygame
+import json
+from time import perf_counter
+from collections import deque
+from contextlib import nullcontext
+from settings import *
 pygame.init()
 font = pygame.font.Font(None,30)
 
@@ -7,4 +12,85 @@ def debug(info,y = 10,x = 10):
     debug_surf = font.render(str(info), True, 'White')
     debug_rect = debug_surf.get_rect(topleft = (x,y))
     pygame.draw.rect(display_surface,'Black',debug_rect)
-    display_surface.blit(debug_surf, debug_rect)
\ No newline at end of file
+    display_surface.blit(debug_surf, debug_rect)
+
+
+class Scope:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *args):
+        self.profiler.add(self.name, (perf_counter() - self.start) * 1000)
+
+
+class Profiler:
+    def __init__(self):
+        # Off until toggled, the scopes cost nothing then
+        self.enabled = PROFILER_ENABLED
+        self.frames = deque(maxlen = PROFILER_HISTORY)  # Last frames: {'frame': ms, scope: ms, 'sprites': n, 'blits': n}
+        self.current = {}
+        self.frame_start = perf_counter()
+        self.colors = {}  # scope -> color in the graph
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.frames.clear()
+
+    def scope(self, name):
+        # with profiler.scope('name'): the time spent inside is added to the current frame
+        return Scope(self, name) if self.enabled else nullcontext()
+
+    def add(self, name, value):
+        self.current[name] = self.current.get(name, 0) + value
+
+    def count(self, name, amount = 1):
+        if self.enabled:
+            self.add(name, amount)
+
+    def end_frame(self):
+        now = perf_counter()
+        if self.enabled:
+            self.current['frame'] = (now - self.frame_start) * 1000
+            self.frames.append(self.current)
+        self.current = {}
+        self.frame_start = now
+
+    def dump(self, path = PROFILER_FILE):
+        with open(path, 'w') as file:
+            json.dump(list(self.frames), file)
+
+    def draw(self, surf):
+        if not self.enabled or not self.frames:
+            return
+        # One column per frame, the scopes stacked from the bottom, 1 px per 0.25 ms
+        graph_rect = pygame.Rect(WINDOW_WIDTH - PROFILER_HISTORY - 10, 10, PROFILER_HISTORY, 120)
+        pygame.draw.rect(surf, 'black', graph_rect)
+        budget_y = graph_rect.bottom - 1000 / TICK_RATE * 4  # One tick worth of time
+        pygame.draw.line(surf, 'white', (graph_rect.left, budget_y), (graph_rect.right, budget_y))
+        for x, frame in enumerate(self.frames, graph_rect.left):
+            y = graph_rect.bottom
+            for name, value in frame.items():
+                if name in ('frame', 'sprites', 'blits'):
+                    continue
+                if name not in self.colors:
+                    self.colors[name] = pygame.Color(0)
+                    self.colors[name].hsva = (len(self.colors) * 67 % 360, 80, 100, 100)
+                height = min(value * 4, y - graph_rect.top)
+                pygame.draw.line(surf, self.colors[name], (x, y), (x, y - height))
+                y -= height
+
+        # Averages of the frames in the graph
+        averages = {name: sum(frame.get(name, 0) for frame in self.frames) / len(self.frames) for name in self.colors}
+        last = self.frames[-1]
+        debug(f'frame {last["frame"]:.1f} ms', graph_rect.bottom + 5, graph_rect.left)
+        debug(f'sprites {last.get("sprites", 0):.0f}  blits {last.get("blits", 0):.0f}', graph_rect.bottom + 27, graph_rect.left)
+        for index, (name, value) in enumerate(averages.items()):
+            debug(f'{name} {value:.2f}', graph_rect.bottom + 52 + index * 22, graph_rect.left)
+            pygame.draw.rect(surf, self.colors[name], (graph_rect.left - 12, graph_rect.bottom + 57 + index * 22, 8, 8))
+
+
+profiler = Profiler()
@@ -1,13 +1,15 @@
 from settings import *
 from random import choice
 from timer import Timer
+from support import flip_frames
 
 class Tooth(pygame.sprite.Sprite):
-    def __init__(self, pos, frames, groups, collision_sprites):
+    def __init__(self, pos, frames, groups, solid_grid):
         super().__init__(groups)
 
         # Animation
         self.frames, self.frame_index = frames, 0
+        self.left_frames = flip_frames(frames)
         self.image = self.frames[self.frame_index]
         self.rect = self.image.get_frect(topleft=pos)
         self.z = Z_LAYERS['main']
@@ -15,7 +17,7 @@ class Tooth(pygame.sprite.Sprite):
         # Movement
         self.speed = 200
         self.direction = choice((-1,1))
-        self.collision_rects = [sprite.rect for sprite in collision_sprites] # Only keep the rect not the whole sprites
+        self.solid_grid = solid_grid  # Shared by the whole level
 
         # Timers
         self.hit_timer = Timer(500)
@@ -26,23 +28,20 @@ class Tooth(pygame.sprite.Sprite):
             self.hit_timer.activate()
 
     def update(self, dt):
-        self.hit_timer.update()
-
         # Animate
         self.frame_index += ANIMATION_SPEED * dt
-        self.image = self.frames[int(self.frame_index) % len(self.frames)]
-        self.image = pygame.transform.flip(self.image, True, False) if self.direction < 0 else self.image
+        frames = self.left_frames if self.direction < 0 else self.frames
+        self.image = frames[int(self.frame_index) % len(frames)]
 
         # Movement
         self.rect.x += self.direction * self.speed * dt
 
-        # Reverse direction
-        floor_rect_right = pygame.FRect(self.rect.bottomright, (1,1))
-        floor_rect_left = pygame.FRect(self.rect.bottomleft, (-1, 1))
-        wall_rect = pygame.FRect(self.rect.topleft + vector(-1,0), (self.rect.width + 2, 2))
-        if floor_rect_right.collidelist(self.collision_rects) == -1 and self.direction > 0 or\
-            floor_rect_left.collidelist(self.collision_rects) == -1 and self.direction < 0 or\
-            wall_rect.collidelist(self.collision_rects) != -1:
+        # Reverse direction, (left, top, right, bottom) probes looked up in the solid tiles
+        left, top, right, bottom = self.rect.left, self.rect.top, self.rect.right, self.rect.bottom
+        floor_right = self.solid_grid.collides(right, bottom, right + 1, bottom + 1)
+        floor_left = self.solid_grid.collides(left - 1, bottom, left, bottom + 1)
+        wall = self.solid_grid.collides(left - 1, top, right + 1, top + 2)
+        if not floor_right and self.direction > 0 or not floor_left and self.direction < 0 or wall:
             self.direction *= -1
 
 
@@ -52,10 +51,8 @@ class Shell(pygame.sprite.Sprite):
 
         # Animation
         if reverse:
-            self.frames = {}
-            for key, surf_list in frames.items():
-                self.frames[key] = [pygame.transform.flip(surf, True, False) for surf in surf_list]
-                self.bullet_direction = -1
+            self.frames = {key: flip_frames(surf_list) for key, surf_list in frames.items()}
+            self.bullet_direction = -1
         else:
             self.frames = frames
             self.bullet_direction = 1
@@ -89,7 +86,6 @@ class Shell(pygame.sprite.Sprite):
 
 
     def update(self, dt):
-        self.shoot_timer.update()
         self.state_management()
 
         # Animation/attack
@@ -128,9 +124,6 @@ class Pearl(pygame.sprite.Sprite):
             self.direction *= -1
             self.timers['reverse'].activate()
     def update(self, dt):
-        for timer in self.timers.values():
-            timer.update()
-
         self.rect.x += self.direction * self.speed * dt
         if not self.timers['lifetime'].active:
             self.kill()
@@ -144,10 +137,8 @@ class Canon(pygame.sprite.Sprite):
 
         # Animation
         if reverse:
-            self.frames = {}
-            for key, surf_list in frames.items():
-                self.frames[key] = [pygame.transform.flip(surf, True, False) for surf in surf_list]
-                self.bullet_direction = -1
+            self.frames = {key: flip_frames(surf_list) for key, surf_list in frames.items()}
+            self.bullet_direction = -1
         else:
             self.frames = frames
             self.bullet_direction = 1
@@ -179,7 +170,6 @@ class Canon(pygame.sprite.Sprite):
             self.shoot_timer.activate()
 
     def update(self, dt):
-        self.shoot_timer.update()
         self.state_management()
 
         # Animation/attack
@@ -218,9 +208,6 @@ class Boulet(pygame.sprite.Sprite):
             self.timers['reverse'].activate()
 
     def update(self, dt):
-        for timer in self.timers.values():
-            timer.update()
-
         self.rect.x += self.direction * self.speed * dt
         if not self.timers['lifetime'].active:
             self.kill()
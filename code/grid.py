@@ -0,0 +1,71 @@
+from settings import *
+from math import ceil
+
+
+def cell_span(start, end, cell_size):
+    # A rect ending exactly on a cell border doesn't reach into the next cell
+    first = int(start // cell_size)
+    return range(first, max(first + 1, ceil(end / cell_size)))
+
+
+class SpatialGrid:
+    def __init__(self, cell_size = TILE_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}  # (col, row) -> {sprite: None}, a dict keeps the insertion order
+        self.sprite_cells = {}  # sprite -> cells it was inserted in
+
+    def cell_keys(self, rect):
+        # Every cell touched by the rect (negative widths are allowed for the contact rects)
+        left, right = sorted((rect.left, rect.right))
+        top, bottom = sorted((rect.top, rect.bottom))
+        return [(col, row)
+                for col in cell_span(left, right, self.cell_size)
+                for row in cell_span(top, bottom, self.cell_size)]
+
+    def add(self, sprite):
+        keys = self.cell_keys(sprite.rect)
+        self.sprite_cells[sprite] = keys
+        for key in keys:
+            self.cells.setdefault(key, {})[sprite] = None
+
+    def remove(self, sprite):
+        for key in self.sprite_cells.pop(sprite, ()):
+            del self.cells[key][sprite]
+
+    def move(self, sprite):
+        # Re-insert a moving sprite, only when it changed cells
+        if self.cell_keys(sprite.rect) != self.sprite_cells[sprite]:
+            self.remove(sprite)
+            self.add(sprite)
+
+    def query(self, rect):
+        # Sprites in the cells overlapped by rect (no exact overlap test)
+        found = {}
+        for key in self.cell_keys(rect):
+            if key in self.cells:
+                found.update(self.cells[key])
+        return found
+
+
+class SolidGrid:
+    def __init__(self, cols, rows, cell_size = TILE_SIZE):
+        self.cols, self.rows = cols, rows
+        self.cell_size = cell_size
+        self.cells = bytearray(cols * rows)  # 1 for a solid tile, one byte per cell
+        self.rects = []  # Solids that aren't aligned on the tiles (crates, barrels, shells)
+
+    def add_tile(self, col, row):
+        self.cells[row * self.cols + col] = 1
+
+    def add_rect(self, rect):
+        self.rects.append(rect)
+
+    def collides(self, left, top, right, bottom):
+        for row in cell_span(top, bottom, self.cell_size):
+            if 0 <= row < self.rows:
+                for col in cell_span(left, right, self.cell_size):
+                    if 0 <= col < self.cols and self.cells[row * self.cols + col]:
+                        return True
+        if self.rects:
+            return pygame.FRect(left, top, right - left, bottom - top).collidelist(self.rects) != -1
+        return False
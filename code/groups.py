@@ -2,40 +2,209 @@ import pygame
 
 from settings import *
 from sprites import Sprite, Cloud
+from grid import SpatialGrid
+from support import tile_surface
 from random import choice, randint
-from timer import Timer
+from itertools import count
+from bisect import insort
+from math import floor
+from debug import profiler
 
-class WorldSprites(pygame.sprite.Group):
+class LayeredSprites(pygame.sprite.Group):
+    def __init__(self):
+        super().__init__()
+        # Sprites bucketed by z, so the drawing order is known without sorting every frame
+        self.layers = {}  # z -> {sprite: None}, a dict keeps the insertion order
+        self.z_order = []  # z values in use, from back to front
+        self.pending_sprites = {}  # The z of a sprite is only set after it joined its groups
+
+        # Static tiles pre-rendered into large surfaces
+        self.chunks = {}  # z -> {(col, row): surface}
+        self.chunk_grid = SpatialGrid(CHUNK_SIZE)
+
+        # Moving sprites are drawn between their last two tick positions
+        self.previous_pos = {}  # sprite -> rect.topleft before the last update
+        self.alpha = 1  # Set by the stage before drawing
+        self.low_detail = False  # Set by the game with ADAPTIVE_DETAIL
+
+        # With DIRTY_RECTS, where each sprite was drawn, to find what changed since the last frame
+        self.drawn = {}  # sprite -> (image, screen rect)
+        self.last_drawn = {}
+        self.last_offset = None
+        self.dirty_rects = []
+
+    def add_layer(self, z):
+        if z not in self.layers:
+            self.layers[z] = {}
+            insort(self.z_order, z)
+
+    def add_internal(self, sprite, layer = None):
+        super().add_internal(sprite, layer)
+        self.pending_sprites[sprite] = None
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        if sprite in self.pending_sprites:
+            del self.pending_sprites[sprite]
+        else:
+            del self.layers[sprite.z][sprite]
+            self.unindex_sprite(sprite)
+
+    def index_pending(self):
+        for sprite in self.pending_sprites:
+            self.add_layer(sprite.z)
+            self.layers[sprite.z][sprite] = None
+            self.index_sprite(sprite)
+        self.pending_sprites.clear()
+
+    def update(self, *args):
+        self.index_pending()
+        self.previous_pos = {sprite: sprite.rect.topleft for sprite in self.moving()}
+        super().update(*args)
+
+    def draw_pos(self, sprite):
+        # Where the sprite is at self.alpha between the last two ticks
+        if sprite in self.previous_pos:
+            (prev_x, prev_y), (x, y) = self.previous_pos[sprite], sprite.rect.topleft
+            return vector(prev_x + (x - prev_x) * self.alpha, prev_y + (y - prev_y) * self.alpha)
+        return vector(sprite.rect.topleft)
+
+    def find_dirty_rects(self):
+        # A camera move changes the whole screen, otherwise only the sprites that moved, changed or left
+        if self.offset != self.last_offset:
+            self.dirty_rects = [self.display_surface.get_rect()]
+        else:
+            self.dirty_rects = []
+            for sprite, (image, rect) in self.drawn.items():
+                last = self.last_drawn.pop(sprite, None)
+                if last != (image, rect):
+                    self.dirty_rects.append(rect)
+                    if last:
+                        self.dirty_rects.append(last[1])
+            self.dirty_rects.extend(rect for image, rect in self.last_drawn.values())
+        self.last_drawn, self.drawn = self.drawn, {}
+        self.last_offset = self.offset.copy()
+
+    def bake(self, pos, surf, z):
+        # Draw a tile that never changes into the chunks of its layer instead of making a sprite
+        self.add_layer(z)
+        chunks = self.chunks.setdefault(z, {})
+        for col, row in self.chunk_grid.cell_keys(surf.get_frect(topleft = pos)):
+            if (col, row) not in chunks:
+                chunks[(col, row)] = pygame.Surface((CHUNK_SIZE, CHUNK_SIZE), pygame.SRCALPHA)
+            chunks[(col, row)].blit(surf, (pos[0] - col * CHUNK_SIZE, pos[1] - row * CHUNK_SIZE))
+
+    def draw_chunks(self, z):
+        if z in self.chunks:
+            view_rect = pygame.FRect(-self.offset.x, -self.offset.y, WINDOW_WIDTH, WINDOW_HEIGHT)
+            for col, row in self.chunk_grid.cell_keys(view_rect):
+                if (col, row) in self.chunks[z]:
+                    # Floored like the tiles inside, a negative position would be truncated towards 0
+                    pos = (floor(col * CHUNK_SIZE + self.offset.x), floor(row * CHUNK_SIZE + self.offset.y))
+                    self.display_surface.blit(self.chunks[z][(col, row)], pos)
+                    profiler.count('blits')
+
+    # Extra bookkeeping for the child classes
+    def index_sprite(self, sprite):
+        pass
+
+    def moving(self):
+        return ()
+
+    def unindex_sprite(self, sprite):
+        pass
+
+
+class WorldSprites(LayeredSprites):
     def __init__(self, data):
         super().__init__()
         self.display_surface = pygame.display.get_surface()
         self.data = data
         self.offset = vector()
 
+        # Main layer, kept sorted by y
+        self.y_sorted = []
+        self.moving_sprites = []
+
+        # Animated water under the whole map
+        self.water_frames = []
+        self.water_index = 0
+        self.water_rect = None
+
+    def index_sprite(self, sprite):
+        if sprite.z == Z_LAYERS['main']:
+            insort(self.y_sorted, sprite, key = lambda sprite: sprite.rect.centery)
+            if hasattr(sprite, 'direction'):
+                self.moving_sprites.append(sprite)
+
+    def unindex_sprite(self, sprite):
+        if sprite.z == Z_LAYERS['main']:
+            self.y_sorted.remove(sprite)
+            if sprite in self.moving_sprites:
+                self.moving_sprites.remove(sprite)
+
+    def moving(self):
+        return self.moving_sprites
+
+    def add_water(self, frames, width, height):
+        # Every water tile shows the same frame, one pre-tiled surface per frame covers the screen
+        self.water_frames = [tile_surface(frame, WINDOW_WIDTH + TILE_SIZE, WINDOW_HEIGHT + TILE_SIZE) for frame in frames]
+        self.water_rect = pygame.Rect(0, 0, width * TILE_SIZE, height * TILE_SIZE)
+
+    def update(self, dt):
+        super().update(dt)
+        self.water_index += ANIMATION_SPEED * dt
+
+    def draw_water(self):
+        # Only on the map, like the tiles were
+        water_surf = self.water_frames[int(self.water_index % len(self.water_frames))]
+        clip_rect = self.water_rect.move(floor(self.offset.x), floor(self.offset.y)).clip(self.display_surface.get_rect())
+        self.display_surface.set_clip(clip_rect)
+        self.display_surface.blit(water_surf, (floor(self.offset.x) % TILE_SIZE - TILE_SIZE, floor(self.offset.y) % TILE_SIZE - TILE_SIZE))
+        self.display_surface.set_clip(None)
+        if DIRTY_RECTS:
+            self.drawn['water'] = (water_surf, clip_rect)  # Compared like a sprite, changes with the frame
+
+    def sort_moving(self):
+        # Only the moving sprites can be out of place
+        for sprite in self.moving_sprites:
+            self.y_sorted.remove(sprite)
+            insort(self.y_sorted, sprite, key = lambda sprite: sprite.rect.centery)
+
     def draw(self, target_pos):
         self.offset.x = -(target_pos[0] - WINDOW_WIDTH / 2)
         self.offset.y = -(target_pos[1] - WINDOW_HEIGHT / 2)
+        self.index_pending()
 
         # Background
-        for sprite in sorted(self, key = lambda sprite: sprite.z):
-            if sprite.z < Z_LAYERS['main']:
-                if sprite.z == Z_LAYERS['path']:  # For the node, only draw the unlocked one
-                    if sprite.level <= sprite.data.unlocked_level:
-                        self.display_surface.blit(sprite.image, sprite.rect.topleft + self.offset)
-                else:
-                    self.display_surface.blit(sprite.image, sprite.rect.topleft + self.offset)
+        if self.water_frames:
+            self.draw_water()
+        for z in self.z_order:
+            if z >= Z_LAYERS['main']:
+                break
+            self.draw_chunks(z)
+            for sprite in self.layers[z]:
+                if sprite.z == Z_LAYERS['path'] and sprite.level > sprite.data.unlocked_level:
+                    continue  # For the node, only draw the unlocked one
+                rect = self.display_surface.blit(sprite.image, sprite.rect.topleft + self.offset)
+                if DIRTY_RECTS:
+                    self.drawn[sprite] = (sprite.image, rect)
 
         # Main
-        for sprite in sorted(self, key=lambda sprite: sprite.rect.centery):
-            if sprite.z == Z_LAYERS['main']:
-                if hasattr(sprite, 'icon'):
-                    self.display_surface.blit(sprite.image, sprite.rect.topleft + self.offset + vector(0,-28))
-                else:
-                    self.display_surface.blit(sprite.image, sprite.rect.topleft + self.offset)
-
+        self.sort_moving()
+        profiler.count('blits', len(self.y_sorted))
+        for sprite in self.y_sorted:
+            if hasattr(sprite, 'icon'):
+                rect = self.display_surface.blit(sprite.image, self.draw_pos(sprite) + self.offset + vector(0,-28))
+            else:
+                rect = self.display_surface.blit(sprite.image, self.draw_pos(sprite) + self.offset)
+            if DIRTY_RECTS:
+                self.drawn[sprite] = (sprite.image, rect)
+        if DIRTY_RECTS:
+            self.find_dirty_rects()
 
 
-class AllSprites(pygame.sprite.Group):
+class AllSprites(LayeredSprites):
     def __init__(self, width, height, clouds, horizon_line, bg_tile = None, top_limit = 0):
         super().__init__()
 
@@ -43,6 +212,12 @@ class AllSprites(pygame.sprite.Group):
         self.display_surface = pygame.display.get_surface()
         self.offset = vector()  # Offset for the camera
 
+        # Culling, per z-layer
+        self.grids = {}  # Sprites that never move, bucketed by tile cell
+        self.moving_sprites = {}
+        self.insert_order = {}  # To keep the order of the sprites sharing a z-layer
+        self.counter = count()
+
         # Level dimension
         self.width = width * TILE_SIZE
         self.height = height * TILE_SIZE
@@ -56,7 +231,11 @@ class AllSprites(pygame.sprite.Group):
         # Background
         self.sky = not bg_tile
         self.horizon_line = horizon_line
-        if bg_tile:
+        self.bg_surf = None
+        if bg_tile and STATIC_CHUNKS:
+            # A single tile repeated everywhere, one pre-tiled surface covers the screen
+            self.bg_surf = tile_surface(bg_tile, WINDOW_WIDTH + TILE_SIZE, WINDOW_HEIGHT + TILE_SIZE)
+        elif bg_tile:
             for col in range(width):
                 for row in range(-int(top_limit / TILE_SIZE) - 1 , height):
                     x, y = col * TILE_SIZE, row * TILE_SIZE
@@ -70,15 +249,48 @@ class AllSprites(pygame.sprite.Group):
             self.large_cloud_x = 0
             self.large_cloud_tiles = int(self.width / self.large_cloud.get_width()) + 2
             self.large_cloud_width, self.large_cloud_height = self.large_cloud.get_size()
-            # Small clouds every 2.5s
-            self.cloud_timer = Timer(2000, self.create_small_cloud, True)
-            self.cloud_timer.activate()
+            # Small clouds every 2s, counted in update so a level off screen doesn't make any
+            self.cloud_interval = 2
+            self.cloud_time = 0
             for cloud in range(15):
                 pos = (randint(0,self.width),randint(self.borders['top'], self.horizon_line))
                 surf = choice(self.small_clouds)
                 Cloud(pos, surf, self)
 
 
+    def add_internal(self, sprite, layer = None):
+        super().add_internal(sprite, layer)
+        self.insert_order[sprite] = next(self.counter)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        del self.insert_order[sprite]
+
+    def index_sprite(self, sprite):
+        # Anything with a direction moves, so it can't live in a fixed cell
+        if hasattr(sprite, 'direction'):
+            self.moving_sprites.setdefault(sprite.z, {})[sprite] = None
+        else:
+            self.grids.setdefault(sprite.z, SpatialGrid()).add(sprite)
+
+    def unindex_sprite(self, sprite):
+        if sprite in self.moving_sprites.get(sprite.z, ()):
+            del self.moving_sprites[sprite.z][sprite]
+        else:
+            self.grids[sprite.z].remove(sprite)
+
+    def moving(self):
+        return [sprite for sprites in self.moving_sprites.values() for sprite in sprites]
+
+    def visible_sprites(self, z):
+        view_rect = pygame.FRect(-self.offset.x, -self.offset.y, WINDOW_WIDTH, WINDOW_HEIGHT)
+        sprites = self.grids[z].query(view_rect) if z in self.grids else {}
+        for sprite in self.moving_sprites.get(z, ()):
+            if sprite.rect.colliderect(view_rect):
+                sprites[sprite] = None
+        # Only the few visible sprites of a layer get ordered, not the whole level
+        return sorted(sprites, key = self.insert_order.get)
+
     def camera_constraint(self):
         # Left limit
         self.offset.x = self.offset.x if self.offset.x < self.borders['left'] else self.borders['left']
@@ -100,10 +312,12 @@ class AllSprites(pygame.sprite.Group):
         pygame.draw.line(self.display_surface, '#f5f1de', (0, horizon_pos),
                          (WINDOW_WIDTH, horizon_pos), 4)
 
-    def draw_large_cloud(self,dt):
+    def move_large_cloud(self, dt):
         self.large_cloud_x += self.large_cloud_speed * self.cloud_direction * dt
         if self.large_cloud_x <= -self.large_cloud_width:
             self.large_cloud_x = 0
+
+    def draw_large_cloud(self):
         for cloud in range(self.large_cloud_tiles):
             left = self.large_cloud_x + self.large_cloud_width * cloud + self.offset.x
             top = self.horizon_line - self.large_cloud_height + self.offset.y
@@ -112,21 +326,94 @@ class AllSprites(pygame.sprite.Group):
     def create_small_cloud(self):
         pos = (randint(self.width + 400, self.width + 600), randint(self.borders['top'], self.horizon_line))
         surf = choice(self.small_clouds)
-        Cloud(pos, surf, self)
+        if not self.low_detail:  # The random numbers are drawn anyway, a replay stays the same
+            Cloud(pos, surf, self)
 
-    def draw(self, target_pos, dt):  # Overwrite the basic draw method for sprite.Group()
+    def update(self, dt):
+        super().update(dt)
+        if self.sky:
+            self.move_large_cloud(dt)
+            self.cloud_time += dt
+            if self.cloud_time >= self.cloud_interval:
+                self.cloud_time -= self.cloud_interval
+                self.create_small_cloud()
+
+    def draw(self, target_pos):  # Overwrite the basic draw method for sprite.Group()
         # Camera movement
-        self.offset.x = -(target_pos[0] - WINDOW_WIDTH / 2)
-        self.offset.y = -(target_pos[1] - WINDOW_HEIGHT / 2)
-        self.camera_constraint()
+        with profiler.scope('camera'):
+            self.offset.x = -(target_pos[0] - WINDOW_WIDTH / 2)
+            self.offset.y = -(target_pos[1] - WINDOW_HEIGHT / 2)
+            self.camera_constraint()
 
-        # Draw the sky
-        if self.sky:
-            self.cloud_timer.update()
-            self.draw_sky()
-            self.draw_large_cloud(dt)
-
-        # Draw the sprites
-        for sprite in sorted(self, key = lambda sprite: sprite.z):  # Sorted according to the Z_LAYERS
-            offset_pos = sprite.rect.topleft + self.offset
-            self.display_surface.blit(sprite.image, offset_pos)
\ No newline at end of file
+        # Draw the background
+        with profiler.scope('sky'):
+            if self.bg_surf:
+                bg_pos = (floor(self.offset.x) % TILE_SIZE - TILE_SIZE, floor(self.offset.y) % TILE_SIZE - TILE_SIZE)
+                self.display_surface.blit(self.bg_surf, bg_pos)
+            if self.sky:
+                self.draw_sky()
+                self.draw_large_cloud()
+
+        # Draw the sprites, ordered according to the Z_LAYERS
+        with profiler.scope('draw'):
+            self.index_pending()
+            for z in self.z_order:
+                self.draw_chunks(z)
+                sprites = self.visible_sprites(z) if VIEWPORT_CULLING else self.layers[z]
+                for sprite in sprites:
+                    offset_pos = self.draw_pos(sprite) + self.offset
+                    rect = self.display_surface.blit(sprite.image, offset_pos)
+                    if DIRTY_RECTS:
+                        self.drawn[sprite] = (sprite.image, rect)
+                profiler.count('blits', len(sprites))
+
+        if DIRTY_RECTS:
+            self.find_dirty_rects()
+            if self.sky:  # The large cloud moves on every tick
+                cloud_top = self.horizon_line - self.large_cloud_height + self.offset.y
+                self.dirty_rects.append(pygame.Rect(0, floor(cloud_top), WINDOW_WIDTH, self.large_cloud_height + 1))
+
+
+class CollisionSprites(pygame.sprite.Group):
+    def __init__(self):
+        super().__init__()
+        # Broadphase, only the sprites in the cells around a rect get tested
+        self.grid = SpatialGrid()
+        self.moving_sprites = {}
+        self.pending_sprites = {}  # Their rect isn't final when they join the group
+
+    def add_internal(self, sprite, layer = None):
+        super().add_internal(sprite, layer)
+        self.pending_sprites[sprite] = None
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        if sprite in self.pending_sprites:
+            del self.pending_sprites[sprite]
+        else:
+            self.grid.remove(sprite)
+            self.moving_sprites.pop(sprite, None)
+
+    def index_pending(self):
+        for sprite in self.pending_sprites:
+            self.grid.add(sprite)
+            if hasattr(sprite, 'moving'):
+                self.moving_sprites[sprite] = None
+        self.pending_sprites.clear()
+
+    def near(self, rect):
+        self.index_pending()
+        for sprite in self.moving_sprites:
+            self.grid.move(sprite)
+        return self.grid.query(rect)
+
+    def collides(self, rect):
+        for sprite in self.near(rect):
+            if rect.colliderect(sprite.rect):
+                return True
+        return False
+
+    def moving(self):
+        # Registry of the moving platforms, only changes when sprites join or leave the group
+        self.index_pending()
+        return self.moving_sprites
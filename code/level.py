@@ -1,12 +1,22 @@
 from settings import *
 from sprites import Sprite, AnimatedSprite, MovingSprite, Spike, Item, ParticleEffectSprite
 from player import Player
-from groups import AllSprites
+from groups import AllSprites, CollisionSprites
+from grid import SolidGrid
+from support import flip_frames
 from enemies import Tooth, Shell, Pearl, Canon, Boulet
+from timer import Timer
+from debug import profiler
 
 from random import uniform
 
 
+def copy_state(state):
+    # Own copies of the values changed in place, the group links are left to add() and kill()
+    return {key: value.copy() if isinstance(value, (pygame.Rect, pygame.FRect, vector, dict)) else value
+            for key, value in state.items() if key != '_Sprite__g'}
+
+
 class Level():
     def __init__(self, tmx_map, level_frames, data, switch_stage):
         self.display_surface = pygame.display.get_surface()
@@ -18,6 +28,7 @@ class Level():
         self.level_bottom = tmx_map.height * TILE_SIZE
         tmx_level_properties = tmx_map.get_layer_by_name('Data')[0].properties
         self.level_unlock = tmx_level_properties['level_unlock']
+        self.completed = False
         if tmx_level_properties['bg']:
             bg_tile = level_frames['bg_tiles'][tmx_level_properties['bg']]
         else:
@@ -32,16 +43,20 @@ class Level():
             clouds = {'large': level_frames['cloud_large'], 'small': level_frames['cloud_small']},
             horizon_line = tmx_level_properties['horizon_line']
         )
-        self.collision_sprites = pygame.sprite.Group()
-        self.semi_collision_sprites = pygame.sprite.Group()
+        self.collision_sprites = CollisionSprites()
+        self.semi_collision_sprites = CollisionSprites()
         self.damage_sprites = pygame.sprite.Group()
         self.tooth_sprites = pygame.sprite.Group()
         self.pearl_sprites = pygame.sprite.Group()
         self.boulet_sprites = pygame.sprite.Group()
         self.item_sprites = pygame.sprite.Group()
+        self.dynamic_sprites = pygame.sprite.Group()  # Restored by reset()
+        self.temporary_sprites = pygame.sprite.Group()  # Projectiles and effects, gone after a reset()
+        self.solid_grid = SolidGrid(tmx_map.width, tmx_map.height)  # For the enemies patrols
 
         # Set up the level
         self.setup(tmx_map, level_frames)
+        self.snapshot = self.take_snapshot()
 
         # Frames
         self.pearl_surf = level_frames['pearl']
@@ -51,9 +66,12 @@ class Level():
         # Get the tiles/terrain
         for layer in ['BG', 'Terrain', 'FG', 'Platforms']:
             for x, y, surf in tmx_map.get_layer_by_name(layer).tiles():
+                pos = (x * TILE_SIZE, y * TILE_SIZE)
                 # Assign each tile to its corresponding groups
-                groups = [self.all_sprites]
-                if layer == 'Terrain': groups.append(self.collision_sprites)
+                groups = []
+                if layer == 'Terrain':
+                    groups.append(self.collision_sprites)
+                    self.solid_grid.add_tile(x, y)
                 if layer == 'Platforms': groups.append(self.semi_collision_sprites)
                 # Assign their correct z-value
                 match layer:
@@ -63,7 +81,13 @@ class Level():
                         z = Z_LAYERS['bg tiles']
                     case _:
                         z = Z_LAYERS['main']
-                Sprite((x * TILE_SIZE, y * TILE_SIZE), surf, groups, z)
+                # Tiles never change, so they are drawn from the pre-rendered chunks
+                if STATIC_CHUNKS:
+                    self.all_sprites.bake(pos, surf, z)
+                else:
+                    groups.append(self.all_sprites)
+                if groups:  # Sprites are still needed for the collisions
+                    Sprite(pos, surf, groups, z)
 
         # Get the bg details
         for obj in tmx_map.get_layer_by_name('BG details'):
@@ -80,7 +104,7 @@ class Level():
             if obj.name == 'player':
                 self.player = Player(
                     pos=(obj.x, obj.y),
-                    groups=self.all_sprites,
+                    groups=(self.all_sprites, self.dynamic_sprites),
                     collision_sprites=self.collision_sprites,
                     semi_collision_sprites=self.semi_collision_sprites,
                     frames=level_frames['player'],
@@ -88,12 +112,13 @@ class Level():
                 )
             else:
                 if obj.name in ('barrel', 'crate'):  # Not animated
-                    Sprite((obj.x, obj.y), obj.image, (self.all_sprites, self.collision_sprites))
+                    sprite = Sprite((obj.x, obj.y), obj.image, (self.all_sprites, self.collision_sprites))
+                    self.solid_grid.add_rect(sprite.rect)
                 else:
                     # frames
                     frames = level_frames[obj.name] if 'palm' not in obj.name else level_frames['palms'][obj.name]
                     if obj.name == 'floor_spike' and obj.properties['inverted']:
-                        frames = [pygame.transform.flip(frame, False, True) for frame in frames]
+                        frames = flip_frames(frames, False, True)
 
                     # groups
                     groups = [self.all_sprites]
@@ -101,6 +126,7 @@ class Level():
                         groups.append(self.semi_collision_sprites)
                     if obj.name in ('floor_spike', 'saw'):
                         groups.append(self.damage_sprites)
+                        groups.append(self.dynamic_sprites)
 
                     # z-index
                     z = Z_LAYERS['main'] if not 'bg' in obj.name else Z_LAYERS['bg details']
@@ -118,7 +144,7 @@ class Level():
                 Spike(
                     pos = (obj.x + obj.width / 2, obj.y, obj.height / 2),
                     surf = level_frames['spike'],
-                    groups = (self.all_sprites, self.damage_sprites),
+                    groups = (self.all_sprites, self.damage_sprites, self.dynamic_sprites),
                     radius = obj.properties['radius'],
                     speed = obj.properties['speed'],
                     start_angle = obj.properties['start_angle'],
@@ -129,7 +155,7 @@ class Level():
                     Spike(
                         pos = (obj.x + obj.width / 2, obj.y, obj.height / 2),
                         surf = level_frames['spike_chain'],
-                        groups = self.all_sprites,
+                        groups = (self.all_sprites, self.dynamic_sprites),
                         radius = radius,
                         speed = obj.properties['speed'],
                         start_angle = obj.properties['start_angle'],
@@ -139,8 +165,8 @@ class Level():
 
             else:
                 frames = level_frames[obj.name]
-                groups = (self.all_sprites, self.semi_collision_sprites) if obj.properties['platform'] else (
-                self.all_sprites, self.damage_sprites)
+                groups = (self.all_sprites, self.semi_collision_sprites, self.dynamic_sprites) if obj.properties['platform'] else (
+                self.all_sprites, self.damage_sprites, self.dynamic_sprites)
                 # Check if moving horizontal or vertical
                 if obj.width > obj.height:  # Horizontal
                     move_dir = 'x'
@@ -172,18 +198,19 @@ class Level():
                 Tooth(
                     pos = (obj.x, obj.y),
                     frames = level_frames['tooth'],
-                    groups = (self.all_sprites, self.damage_sprites, self.tooth_sprites),
-                    collision_sprites = self.collision_sprites
+                    groups = (self.all_sprites, self.damage_sprites, self.tooth_sprites, self.dynamic_sprites),
+                    solid_grid = self.solid_grid
                 )
             if obj.name == 'shell':
-                Shell(
+                shell = Shell(
                     pos = (obj.x, obj.y),
                     frames = level_frames['shell'],
-                    groups = (self.all_sprites, self.collision_sprites),
+                    groups = (self.all_sprites, self.collision_sprites, self.dynamic_sprites),
                     reverse = obj.properties['reverse'],
                     player = self.player,
                     create_pearl = self.create_pearl
                 )
+                self.solid_grid.add_rect(shell.rect)
 
         # Get the items
         for obj in tmx_map.get_layer_by_name('Items'):
@@ -191,7 +218,7 @@ class Level():
                 item_type = obj.name,
                 pos = (obj.x+TILE_SIZE/2, obj.y+TILE_SIZE/2),
                 frames = level_frames['items'][obj.name],
-                groups = (self.all_sprites, self.item_sprites),
+                groups = (self.all_sprites, self.item_sprites, self.dynamic_sprites),
                 data = self.data
             )
 
@@ -210,9 +237,27 @@ class Level():
                     else:
                         Sprite((x,y), level_frames['water_body'], self.all_sprites, Z_LAYERS['water'])
 
+    def take_snapshot(self):
+        # State of everything that moves, gets collected or dies, right after the setup
+        return [(sprite, sprite.groups(), copy_state(sprite.__dict__)) for sprite in self.dynamic_sprites]
+
+    def reset(self):
+        # Retry without rebuilding: the tiles and decorations stay, the rest goes back to the snapshot
+        self.completed = False
+        for sprite in self.temporary_sprites.sprites():
+            sprite.kill()
+        for sprite, groups, state in self.snapshot:
+            sprite.__dict__.update(copy_state(state))
+            for value in state.values():
+                for timer in value.values() if isinstance(value, dict) else (value,):
+                    if isinstance(timer, Timer) and timer.active:
+                        timer.deactivate()
+            sprite.add(groups)  # Collected items and killed enemies come back
+        self.all_sprites.previous_pos.clear()
+
     def create_pearl(self, pos, direction):
         Pearl(pos = pos,
-              groups = (self.all_sprites, self.damage_sprites, self.pearl_sprites),
+              groups = (self.all_sprites, self.damage_sprites, self.pearl_sprites, self.temporary_sprites),
               surf = self.pearl_surf,
               direction = direction,
               speed = 150
@@ -220,25 +265,26 @@ class Level():
 
     def create_boulet(self, pos, direction):
         Boulet(pos = pos,
-              groups = (self.all_sprites, self.damage_sprites, self.boulet_sprites),
+              groups = (self.all_sprites, self.damage_sprites, self.boulet_sprites, self.temporary_sprites),
               surf = self.boulet_surf,
               direction = direction,
               speed = 150
         )
 
+    def projectile_collision(self, projectiles):
+        # Check collisions with walls to destroy the projectiles, each one only looks at the terrain around it
+        if not projectiles:
+            return
+        for sprite in projectiles.sprites():  # .sprites() makes a copy, they get killed in the loop
+            if self.collision_sprites.collides(sprite.rect):
+                ParticleEffectSprite((sprite.rect.center), self.particle_frames, (self.all_sprites, self.temporary_sprites))
+                sprite.kill()
+
     def pearl_collision(self):
-        # Check collisions with walls to destroy the pearls
-        for sprite in self.collision_sprites:
-            sprite_colliding = pygame.sprite.spritecollide(sprite, self.pearl_sprites, dokill=True)
-            if sprite_colliding:
-                ParticleEffectSprite((sprite_colliding[0].rect.center), self.particle_frames, self.all_sprites)
+        self.projectile_collision(self.pearl_sprites)
 
     def boulet_collision(self):
-        # Check collisions with walls to destroy the boulets
-        for sprite in self.collision_sprites:
-            sprite_colliding = pygame.sprite.spritecollide(sprite, self.boulet_sprites, dokill=True)
-            if sprite_colliding:
-                ParticleEffectSprite((sprite_colliding[0].rect.center), self.particle_frames, self.all_sprites)
+        self.projectile_collision(self.boulet_sprites)
 
     def hit_collision(self):
         # Check any dmg to the player (and destroy bullets)
@@ -246,16 +292,16 @@ class Level():
             if sprite.rect.colliderect(self.player.hitbox_rect):
                 self.player.get_damage()
                 if hasattr(sprite, 'pearl'):
-                    ParticleEffectSprite((sprite.rect.center), self.particle_frames, self.all_sprites)
+                    ParticleEffectSprite((sprite.rect.center), self.particle_frames, (self.all_sprites, self.temporary_sprites))
                     sprite.kill()
                 if hasattr(sprite, 'boulet'):
-                    ParticleEffectSprite((sprite.rect.center), self.particle_frames, self.all_sprites)
+                    ParticleEffectSprite((sprite.rect.center), self.particle_frames, (self.all_sprites, self.temporary_sprites))
                     sprite.kill()
 
     def item_collision(self):
         for sprite in self.item_sprites:
             if sprite.rect.colliderect(self.player.hitbox_rect):
-                ParticleEffectSprite((sprite.rect.center), self.particle_frames, self.all_sprites)
+                ParticleEffectSprite((sprite.rect.center), self.particle_frames, (self.all_sprites, self.temporary_sprites))
                 sprite.activate()
                 sprite.kill()
 
@@ -280,20 +326,31 @@ class Level():
 
         # Success state, i.e. reached the flag
         if self.player.hitbox_rect.colliderect(self.level_finish_rect):
+            self.completed = True
             self.switch_stage('overworld', self.level_unlock)
 
 
-    def run(self, dt):
-        self.display_surface.fill('black')
-
-        # Update
-        self.all_sprites.update(dt)
-        self.pearl_collision()
-        self.boulet_collision()
-        self.hit_collision()
-        self.item_collision()
-        self.attack_collision()
+    def update(self, dt):
+        with profiler.scope('sprite update'):
+            self.all_sprites.update(dt)
+        with profiler.scope('pearl collision'):
+            self.pearl_collision()
+        with profiler.scope('boulet collision'):
+            self.boulet_collision()
+        with profiler.scope('hit collision'):
+            self.hit_collision()
+        with profiler.scope('item collision'):
+            self.item_collision()
+        with profiler.scope('attack collision'):
+            self.attack_collision()
         self.check_constraint()
 
-        # Draw
-        self.all_sprites.draw(self.player.hitbox_rect.center, dt)
+    def draw(self, alpha = 1):
+        # No fill, the sky or the background tiles cover the whole screen
+        # The camera follows the player where it is drawn
+        self.all_sprites.alpha = alpha
+        self.all_sprites.draw(self.all_sprites.draw_pos(self.player) + vector(self.player.rect.size) / 2)
+
+    def run(self, dt):
+        self.update(dt)
+        self.draw()
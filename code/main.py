@@ -1,23 +1,39 @@
-from pytmx.util_pygame import load_pygame
 from os.path import join
+from os import environ
+from random import seed, randrange
+from argparse import ArgumentParser, ArgumentTypeError
+from time import perf_counter
 
 from settings import *
 from level import Level
 from support import *
 from data import Data
-from debug import debug
+from debug import profiler
 from ui import UI
 from overworld import Overworld
+from timer import scheduler
+from map_cache import load_map, MapRepository
+from controls import controls, Keyboard, ScriptedInput
+from replay import Recorder, Replay, FrameTimes, load_replay, SEED_RANGE
 
 
 class Game():
-    def __init__(self):
+    def __init__(self, headless = False):
+        # Headless: no window and nothing drawn, for simulations on a machine without a display
+        self.headless = headless
+        if headless:
+            environ['SDL_VIDEODRIVER'] = 'dummy'
+            pygame.display.quit()  # Already started with the real driver by the debug module
         pygame.init()
 
         # Create the screen
         self.display_surface = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
         pygame.display.set_caption('??? World')
         self.clock = pygame.time.Clock()  # For the FPS
+        self.frame_times = None  # FrameTimes when the work time of the frames is captured
+        self.presented_stage = None  # Stage on screen after the last display update
+        self.work_time = 0  # Time spent on a frame, smoothed
+        self.low_detail = False
 
         # Import the images
         self.import_assets()
@@ -28,21 +44,22 @@ class Game():
 
         # Import the UI
 
-        # Import the levels
-        self.tmx_maps = {
-            0: load_pygame(join('..', 'data', 'levels', '0.tmx')),
-            1: load_pygame(join('..', 'data', 'levels', '1.tmx')),
-            2: load_pygame(join('..', 'data', 'levels', '2.tmx')),
-            3: load_pygame(join('..', 'data', 'levels', '3.tmx')),
-            4: load_pygame(join('..', 'data', 'levels', '4.tmx')),
-            5: load_pygame(join('..', 'data', 'levels', '5.tmx')),
-        }
-        self.tmx_overworld = load_pygame(join('..', 'data', 'overworld', 'overworld.tmx'))
-        self.current_stage = Level(self.tmx_maps[self.data.current_level], self.level_frames, self.data, self.switch_stage)
+        # Import the levels, each one read the first time it is played
+        self.tmx_maps = MapRepository(join('..', 'data', 'levels'))
+        self.tmx_overworld = load_map(join('..', 'data', 'overworld', 'overworld.tmx'))
+        self.level = Level(self.tmx_maps[self.data.current_level], self.level_frames, self.data, self.switch_stage)
+        self.level_key = self.data.current_level
+        self.current_stage = self.level
 
     def switch_stage(self, target, unlock = 0):
         if target == 'level':
-            self.current_stage = Level(self.tmx_maps[self.data.current_level], self.level_frames, self.data, self.switch_stage)
+            # The last level is kept, playing it again only resets it
+            if self.level_key == self.data.current_level:
+                self.level.reset()
+            else:
+                self.level = Level(self.tmx_maps[self.data.current_level], self.level_frames, self.data, self.switch_stage)
+                self.level_key = self.data.current_level
+            self.current_stage = self.level
         else:  # Overworld
             if unlock >0:
                 self.data.unlocked_level = unlock
@@ -51,9 +68,22 @@ class Game():
             self.current_stage = Overworld (tmx_map = self.tmx_overworld,
                                             data = self.data,
                                             overworld_frames = self.overworld_frames,
-                                            switch_stage = self.switch_stage)
+                                            switch_stage = self.switch_stage,
+                                            prefetch = self.tmx_maps.prefetch)
+
+    def draw_loading(self, done, total):
+        # Progress bar while the images are decoded
+        bar_rect = pygame.FRect(0, 0, WINDOW_WIDTH / 2, 20)
+        bar_rect.center = (WINDOW_WIDTH / 2, WINDOW_HEIGHT / 2)
+        self.display_surface.fill('black')
+        pygame.draw.rect(self.display_surface, 'white', bar_rect, 2)
+        pygame.draw.rect(self.display_surface, 'white', bar_rect.scale_by(done / total, 1).move_to(left = bar_rect.left))
+        pygame.event.pump()  # Keep the window responsive
+        pygame.display.update()
 
     def import_assets(self):
+        preload_images(asset_paths('..', 'graphics'), None if self.headless else self.draw_loading)
+        load_atlas('..', 'graphics', 'atlas')  # Packed sheets if atlas.py was run, single files otherwise
         self.level_frames = {
             'flag': import_folder('..', 'graphics', 'level', 'flag'),
             'floor_spike': import_folder('..', 'graphics', 'enemies', 'floor_spikes'),
@@ -95,33 +125,167 @@ class Game():
 
     def check_game_over(self):
         if self.data.health <=0:
+            self.quit()
+
+    def quit(self):
+        # Save what was recorded during the run first, the rest is done even if that fails
+        try:
+            if hasattr(controls.provider, 'save'):
+                controls.provider.save()
+        finally:
+            if self.frame_times:
+                self.frame_times.save()
+                print(self.frame_times.summary())
             pygame.quit()
-            sys.exit()
+        sys.exit()
+
+    def step(self):
+        # One tick of the simulation, the timers, the stage and the UI always move by the same time
+        scheduler.update()
+        with profiler.scope('input'):
+            controls.tick()
+        self.current_stage.update(1 / TICK_RATE)
+        with profiler.scope('ui'):
+            self.ui.update(1 / TICK_RATE)
+
+    def draw(self, alpha = 1):
+        # alpha: how far the frame is between the last two ticks
+        self.current_stage.draw(alpha)
+        with profiler.scope('ui'):
+            self.ui.draw()
+        profiler.count('sprites', len(self.current_stage.all_sprites))
+        profiler.draw(self.display_surface)
+
+    def present(self):
+        # With DIRTY_RECTS, only the changes reported by the stage and the UI go to the window
+        if DIRTY_RECTS and self.current_stage is self.presented_stage and not profiler.enabled:
+            pygame.display.update(self.current_stage.all_sprites.dirty_rects + self.ui.dirty_rects)
+        else:
+            pygame.display.update()
+        self.presented_stage = self.current_stage
+
+    def frame_rate(self):
+        # Fewer frames while nothing happens, the ticks still follow the real time
+        if hasattr(self.current_stage, 'idle') and self.current_stage.idle():
+            return IDLE_FPS
+        return TARGET_FPS
+
+    def adapt_detail(self, work_time):
+        # Cosmetic work is dropped while the frames take longer than their budget
+        # work_time: ms spent on the last frame, without the wait of the frame cap
+        self.work_time += (work_time - self.work_time) * 0.1
+        budget = 1000 / (self.frame_rate() or TICK_RATE)
+        if self.work_time > budget:
+            self.low_detail = True
+        elif self.work_time < budget * DETAIL_RECOVERY:
+            self.low_detail = False
+        self.current_stage.all_sprites.low_detail = self.low_detail
+        self.ui.low_detail = self.low_detail
+
+    def simulate(self, level, ticks, script):
+        # Play a level with scripted keys until it ends or the ticks run out, as fast as possible
+        # Every run starts from a new game, whatever was played before
+        self.ui.reset()
+        self.data.reset()
+        self.data.current_level = level
+        self.switch_stage('level')
+        stage = self.current_stage
+        exits = []  # Instead of leaving for the overworld
+        stage.switch_stage = lambda target, unlock = 0: exits.append(unlock)
+        controls.provider = ScriptedInput(script)
+
+        tick = 0
+        try:
+            while tick < ticks and not exits and self.data.health > 0:
+                self.step()
+                if not self.headless:
+                    self.draw()
+                tick += 1
+        finally:
+            stage.switch_stage = self.switch_stage
+            controls.provider = Keyboard()
+        if stage.completed:
+            outcome = 'completed'
+        elif exits:
+            outcome = 'fell'
+        elif self.data.health <= 0:
+            outcome = 'dead'
+        else:
+            outcome = 'timeout'
+        return {
+            'level': level,
+            'outcome': outcome,
+            'ticks': tick,
+            'health': self.data.health,
+            'coins': self.data.coins,
+            'position': tuple(stage.player.hitbox_rect.topleft),
+        }
 
     def run(self):
+        accumulator = 0
         while True:
-            # Store the time between 2 images to normalize the speed of the movement
-            dt = self.clock.tick() / 1000
+            # Real time to simulate, capped so a long stall doesn't turn into a burst of ticks
+            frame_time = self.clock.tick(self.frame_rate())
+            accumulator += min(frame_time / 1000, MAX_FRAME_TIME)
+            frame_start = perf_counter()
 
             # Go through the events
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
+                    self.quit()
+                if event.type == pygame.KEYDOWN and event.key == PROFILER_KEY:
+                    profiler.toggle()
+                if event.type == pygame.KEYDOWN and event.key == PROFILER_DUMP_KEY:
+                    profiler.dump()
+            if getattr(controls.provider, 'finished', False):  # End of a replay
+                self.quit()
 
-            # Game over
-            self.check_game_over()
+            # Fixed-length ticks until the simulation caught up with the real time
+            while accumulator >= 1 / TICK_RATE:
+                self.check_game_over()
+                self.step()
+                accumulator -= 1 / TICK_RATE
 
-            # Run the current stage
-            self.current_stage.run(dt)
+            # Update what's on screen, in between the last two ticks
+            self.draw(accumulator * TICK_RATE)
+            self.present()
 
-            # Update UI
-            self.ui.update(dt)
+            # The work of the frame only, the wait of the frame cap says nothing about the engine
+            work_time = (perf_counter() - frame_start) * 1000
+            if self.frame_times:
+                self.frame_times.add(work_time)
+            if ADAPTIVE_DETAIL:
+                self.adapt_detail(work_time)
+            profiler.end_frame()
 
-            # Update what's on screen
-            pygame.display.update()
+
+def seed_argument(value):
+    # Only the seeds a recording can store
+    if not value.isdigit() or int(value) not in SEED_RANGE:
+        raise ArgumentTypeError(f'{value} is not a seed, from 0 to {SEED_RANGE.stop - 1}')
+    return int(value)
 
 
 if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--record', metavar = 'FILE', help = 'save the keys of every tick to FILE')
+    parser.add_argument('--replay', metavar = 'FILE', help = 'play the keys saved in FILE, then quit')
+    parser.add_argument('--frame-times', metavar = 'FILE', help = 'save the time spent on every frame to FILE, in ms, without the wait of the frame cap')
+    parser.add_argument('--seed', type = seed_argument, help = 'random seed, a recording stores its own')
+    args = parser.parse_args()
+
+    # Same seed and same keys on every tick give the same run
+    if args.replay:
+        run_seed, masks = load_replay(args.replay)
+    else:
+        run_seed = args.seed if args.seed is not None else randrange(SEED_RANGE.stop)
+    seed(run_seed)
+
     game = Game()
+    if args.replay:
+        controls.provider = Replay(masks)
+    elif args.record:
+        controls.provider = Recorder(Keyboard(), args.record, run_seed)
+    if args.frame_times:
+        game.frame_times = FrameTimes(args.frame_times)
     game.run()
@@ -0,0 +1,208 @@
+import pickle
+
+from settings import *
+from support import load_image, decoded_images, atlas_frames
+from array import array
+from collections import namedtuple, OrderedDict
+from os.path import join, dirname, relpath, normpath, getmtime, exists, splitext
+from os import replace, listdir
+from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+# Compiled TMX maps: the tile grids, objects and properties pickled next to the .tmx file
+# Rebuilt with pytmx only when the map or one of its tilesets changed
+CACHE_VERSION = 1
+Point = namedtuple('Point', ('x', 'y'))
+
+
+class TileLayer:
+    def __init__(self, name, gids, width, images):
+        self.name = name
+        self.gids = gids  # One gid per cell, row by row
+        self.width = width
+        self.images = images
+
+    def tiles(self):
+        for index, gid in enumerate(self.gids):
+            if gid and self.images.get(gid):
+                yield index % self.width, index // self.width, self.images[gid]
+
+
+class MapObject:
+    def __init__(self, data, images):
+        self.name = data['name']
+        self.x, self.y = data['x'], data['y']
+        self.width, self.height = data['width'], data['height']
+        self.properties = data['properties']
+        self.points = [Point(*point) for point in data['points']]
+        self.image = images.get(data['gid'])
+
+
+class CompiledMap:
+    def __init__(self, data, folder_path, decoded_sources = None):
+        self.width, self.height = data['width'], data['height']
+        self.properties = data['properties']
+
+        # Tile images, cut out of each tileset image loaded once
+        # The tileset images only belong to this map, so they go away with it
+        sources = {}
+        self.images = {}
+        for gid, (image_path, rect, flags) in data['tiles'].items():
+            image_path = join(folder_path, image_path)
+            if image_path not in sources:
+                if decoded_sources and image_path in decoded_sources:
+                    sources[image_path] = decoded_sources[image_path].convert_alpha()
+                else:
+                    sources[image_path] = load_image(image_path)
+            self.images[gid] = flip_tile(sources[image_path].subsurface(rect) if rect else sources[image_path], flags)
+
+        self.layers = {}
+        for name, layer_type, layer_data in data['layers']:
+            if layer_type == 'tiles':
+                self.layers[name] = TileLayer(name, layer_data, self.width, self.images)
+            else:
+                self.layers[name] = [MapObject(obj_data, self.images) for obj_data in layer_data]
+
+    def get_layer_by_name(self, name):
+        return self.layers[name]
+
+
+def flip_tile(tile, flags):
+    # Same transformations as pytmx
+    flip_x, flip_y, flip_diagonal = flags
+    if flip_diagonal:
+        tile = pygame.transform.flip(pygame.transform.rotate(tile, 270), True, False)
+    if flip_x or flip_y:
+        tile = pygame.transform.flip(tile, flip_x, flip_y)
+    return tile
+
+
+def map_sources(tmx_path):
+    # The .tmx and its external tilesets, any change in them invalidates the cache
+    sources = [tmx_path]
+    for tileset in ElementTree.parse(tmx_path).getroot().iter('tileset'):
+        if 'source' in tileset.attrib:
+            sources.append(normpath(join(dirname(tmx_path), tileset.attrib['source'])))
+    return sources
+
+
+def compile_map(tmx_path):
+    from pytmx import TiledMap, TiledTileLayer  # Only needed when the cache is stale
+
+    # Without an image loader pytmx only gives (image path, rect, flags) per gid
+    tmx_map = TiledMap(tmx_path)
+    folder_path = dirname(tmx_path)
+    tiles = {}
+    for gid, image in enumerate(tmx_map.images):
+        if image:
+            image_path, rect, flags = image
+            flags = tuple(bool(flag) for flag in flags) if flags else (False, False, False)
+            tiles[gid] = (relpath(normpath(image_path), folder_path), tuple(rect) if rect else None, flags)
+
+    layers = []
+    for layer in tmx_map.layers:
+        if isinstance(layer, TiledTileLayer):
+            layers.append((layer.name, 'tiles', array('H', (gid for row in layer.data for gid in row))))
+        else:
+            objects = [{
+                'name': obj.name,
+                'x': obj.x, 'y': obj.y,
+                'width': obj.width, 'height': obj.height,
+                'gid': obj.gid,
+                'properties': obj.properties,
+                'points': [tuple(point) for point in getattr(obj, 'points', ())]
+            } for obj in layer]
+            layers.append((layer.name, 'objects', objects))
+
+    return {
+        'version': CACHE_VERSION,
+        'sources': {path: getmtime(path) for path in map_sources(tmx_path)},
+        'width': tmx_map.width,
+        'height': tmx_map.height,
+        'properties': tmx_map.properties,
+        'tiles': tiles,
+        'layers': layers,
+    }
+
+
+def read_cache(cache_path):
+    if not exists(cache_path):
+        return None
+    with open(cache_path, 'rb') as file:
+        data = pickle.load(file)
+    if data.get('version') != CACHE_VERSION:
+        return None
+    for path, mtime in data['sources'].items():
+        if not exists(path) or getmtime(path) != mtime:
+            return None
+    return data
+
+
+def load_map_data(tmx_path):
+    cache_path = tmx_path + 'c'  # 0.tmx -> 0.tmxc
+    data = read_cache(cache_path)
+    if data is None:
+        data = compile_map(tmx_path)
+        with open(cache_path + '.tmp', 'wb') as file:
+            pickle.dump(data, file, pickle.HIGHEST_PROTOCOL)
+        replace(cache_path + '.tmp', cache_path)
+    return data
+
+
+def load_map(tmx_path):
+    return CompiledMap(load_map_data(tmx_path), dirname(tmx_path))
+
+
+def read_map(tmx_path):
+    # Everything that doesn't need the display, so it can run on another thread
+    data = load_map_data(tmx_path)
+    decoded_sources = {}
+    for image_path, _, _ in data['tiles'].values():
+        image_path = join(dirname(tmx_path), image_path)
+        if image_path not in decoded_sources and normpath(image_path) not in decoded_images and normpath(image_path) not in atlas_frames:
+            decoded_sources[image_path] = pygame.image.load(image_path)
+    return data, decoded_sources
+
+
+class MapRepository:
+    def __init__(self, folder_path, size = MAP_CACHE_SIZE):
+        # Every .tmx of the folder, '0.tmx' is stored under 0 like data.current_level
+        self.paths = {}
+        for file_name in sorted(listdir(folder_path)):
+            name, extension = splitext(file_name)
+            if extension == '.tmx':
+                self.paths[int(name) if name.isdigit() else name] = join(folder_path, file_name)
+
+        # Recently played maps, the oldest one is dropped past the size
+        self.size = size
+        self.maps = OrderedDict()
+
+        # Maps read in the background before they are asked for
+        self.executor = ThreadPoolExecutor(max_workers = 1)
+        self.pending = {}  # key -> future of read_map
+
+    def __getitem__(self, key):
+        if key in self.maps:
+            self.maps.move_to_end(key)
+            return self.maps[key]
+
+        if key in self.pending:
+            data, decoded_sources = self.pending.pop(key).result()
+        else:
+            data, decoded_sources = read_map(self.paths[key])
+        tmx_map = CompiledMap(data, dirname(self.paths[key]), decoded_sources)
+
+        self.maps[key] = tmx_map
+        while len(self.maps) > self.size:
+            self.maps.popitem(last = False)  # Its tiles and tileset images go with it
+        return tmx_map
+
+    def prefetch(self, keys):
+        # Forget the reads nobody wants anymore, then start the missing ones
+        for key in list(self.pending):
+            # A read still running can't be stopped, it is kept to be waited for instead of read twice
+            if key not in keys and (self.pending[key].cancel() or self.pending[key].done()):
+                del self.pending[key]
+        for key in keys:
+            if key in self.paths and key not in self.maps and key not in self.pending:
+                self.pending[key] = self.executor.submit(read_map, self.paths[key])
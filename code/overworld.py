@@ -4,9 +4,11 @@ from settings import *
 from sprites import Sprite, AnimatedSprite, Node, Icon, PathSprite
 from groups import WorldSprites
 from random import randint
+from controls import controls
+from debug import profiler
 
 class Overworld:
-    def __init__(self, tmx_map, data, overworld_frames, switch_stage):
+    def __init__(self, tmx_map, data, overworld_frames, switch_stage, prefetch = None):
         self.display_surface = pygame.display.get_surface()
         self.data = data
 
@@ -25,16 +27,26 @@ class Overworld:
         # Switch stage
         self.switch_stage = switch_stage
 
+        # Read the levels around the icon in the background
+        self.prefetch = prefetch
+        self.prefetch_levels()
+
     def setup(self, tmx_map, overworld_frames):
         # Tiles
         for layer in ['main', 'top']:
             for x, y, surf in tmx_map.get_layer_by_name(layer).tiles():
-                Sprite((x * TILE_SIZE,y * TILE_SIZE), surf, self.all_sprites, Z_LAYERS['bg tiles'])
+                if STATIC_CHUNKS:
+                    self.all_sprites.bake((x * TILE_SIZE,y * TILE_SIZE), surf, Z_LAYERS['bg tiles'])
+                else:
+                    Sprite((x * TILE_SIZE,y * TILE_SIZE), surf, self.all_sprites, Z_LAYERS['bg tiles'])
 
         # Water
-        for col in range(tmx_map.width):
-            for row in range(tmx_map.height):
-                AnimatedSprite((col * TILE_SIZE,row * TILE_SIZE), overworld_frames['water'], self.all_sprites, Z_LAYERS['bg'])
+        if STATIC_CHUNKS:
+            self.all_sprites.add_water(overworld_frames['water'], tmx_map.width, tmx_map.height)
+        else:
+            for col in range(tmx_map.width):
+                for row in range(tmx_map.height):
+                    AnimatedSprite((col * TILE_SIZE,row * TILE_SIZE), overworld_frames['water'], self.all_sprites, Z_LAYERS['bg'])
 
         # Objects
         for obj in tmx_map.get_layer_by_name('Objects'):
@@ -42,7 +54,7 @@ class Overworld:
                 animation_speed =  randint(4,6)
                 AnimatedSprite((obj.x, obj.y), overworld_frames['palm'], self.all_sprites, Z_LAYERS['main'], animation_speed)
             else:
-                z = Z_LAYERS[f'{'bg details' if obj.name == 'grass' else 'bg tiles'}']
+                z = Z_LAYERS['bg details' if obj.name == 'grass' else 'bg tiles']
                 Sprite((obj.x, obj.y), obj.image, self.all_sprites, z)
 
         # Paths
@@ -130,7 +142,7 @@ class Overworld:
                         level=key)
 
     def input(self):
-        keys = pygame.key.get_pressed()
+        keys = controls.get_pressed()
         if self.current_node and not self.icon.path:
             if keys[pygame.K_DOWN] or keys[pygame.K_s] and self.current_node.can_move('down'):
                 self.move('down')
@@ -150,13 +162,40 @@ class Overworld:
         path = self.paths[path_key]['pos'][:] if not path_reverse else self.paths[path_key]['pos'][::-1]
         self.icon.start_move(path)
 
+    def reachable_levels(self):
+        # The current level and the ones at the other end of its open paths
+        levels = [self.current_node.level]
+        for direction, path in self.current_node.paths.items():
+            if self.current_node.can_move(direction):
+                path_key = int(path[0])
+                levels.append(self.paths[path_key]['start'] if path[-1] == 'r' else path_key)
+        return levels
+
+    def prefetch_levels(self):
+        if self.prefetch:
+            self.prefetch(self.reachable_levels())
+
     def get_current_node(self):
         nodes = pygame.sprite.spritecollide(self.icon, self.node_sprites, False)
-        if nodes:
+        if nodes and nodes[0] != self.current_node:
             self.current_node = nodes[0]
+            self.prefetch_levels()
 
-    def run(self, dt):
+    def idle(self):
+        # Only the scenery moves while the icon waits on a node
+        return not self.icon.path
+
+    def update(self, dt):
         self.input()
         self.get_current_node()
-        self.all_sprites.update(dt)
-        self.all_sprites.draw(self.icon.rect.center)
\ No newline at end of file
+        with profiler.scope('sprite update'):
+            self.all_sprites.update(dt)
+
+    def draw(self, alpha = 1):
+        self.all_sprites.alpha = alpha
+        with profiler.scope('draw'):
+            self.all_sprites.draw(self.all_sprites.draw_pos(self.icon) + vector(self.icon.rect.size) / 2)
+
+    def run(self, dt):
+        self.update(dt)
+        self.draw()
\ No newline at end of file
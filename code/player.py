@@ -1,6 +1,8 @@
 from math import sin
 from settings import *
-from timer import Timer
+from timer import Timer, scheduler
+from support import flip_frames, silhouette_frames
+from controls import controls
 
 class Player(pygame.sprite.Sprite):
     def __init__(self, pos, groups, collision_sprites, semi_collision_sprites, frames, data):
@@ -11,6 +13,9 @@ class Player(pygame.sprite.Sprite):
 
         # Images
         self.frames, self.frames_index = frames, 0
+        self.left_frames = {state: flip_frames(surfs) for state, surfs in frames.items()}
+        self.hit_frames = {state: silhouette_frames(surfs) for state, surfs in frames.items()}
+        self.left_hit_frames = {state: silhouette_frames(surfs) for state, surfs in self.left_frames.items()}
         self.state, self.facing_right = 'idle', True
         self.image = self.frames[self.state][self.frames_index]
 
@@ -44,7 +49,7 @@ class Player(pygame.sprite.Sprite):
 
 
     def input(self):
-        keys = pygame.key.get_pressed()
+        keys = controls.get_pressed()
         input_vector = vector(0,0)
 
         # Movement and attacks
@@ -117,22 +122,20 @@ class Player(pygame.sprite.Sprite):
         floor_rect = pygame.Rect(self.hitbox_rect.bottomleft,(self.hitbox_rect.width,2)) # (left, top), (width, height)
         left_rect = pygame.Rect((self.hitbox_rect.topleft + vector(0, self.hitbox_rect.height / 4)), (-2, self.hitbox_rect.height / 2))
         right_rect = pygame.Rect((self.hitbox_rect.topright + vector(0, self.hitbox_rect.height / 4)), (2, self.hitbox_rect.height / 2))
-        collide_rects = [sprite.rect for sprite in self.collision_sprites]
-        semi_collide_rect = [sprite.rect for sprite in self.semi_collision_sprites]
-        # Collisions
-        self.on_surface['floor'] = True if floor_rect.collidelist(collide_rects) >= 0 or floor_rect.collidelist(semi_collide_rect) >= 0 and self.direction.y >= 0 else False
-        self.on_surface['left'] = True if left_rect.collidelist(collide_rects) >= 0 else False
-        self.on_surface['right'] = True if right_rect.collidelist(collide_rects) >= 0 else False
+        # Collisions, only against the sprites around each rect
+        self.on_surface['floor'] = self.collision_sprites.collides(floor_rect) or self.semi_collision_sprites.collides(floor_rect) and self.direction.y >= 0
+        self.on_surface['left'] = self.collision_sprites.collides(left_rect)
+        self.on_surface['right'] = self.collision_sprites.collides(right_rect)
         # Check at each iteration if we are on a platform
         self.platform = None
-        sprites = self.collision_sprites.sprites() + self.semi_collision_sprites.sprites() # .sprites() makes a list
-        for sprite in [sprite for sprite in sprites if hasattr(sprite, 'moving')]:
-            if sprite.rect.colliderect(floor_rect):
-                self.platform = sprite
+        for sprites in (self.collision_sprites.moving(), self.semi_collision_sprites.moving()):
+            for sprite in sprites:
+                if sprite.rect.colliderect(floor_rect):
+                    self.platform = sprite
 
 
     def collision(self, axis):
-        for sprite in self.collision_sprites:
+        for sprite in self.collision_sprites.near(self.hitbox_rect):
             if sprite.rect.colliderect(self.hitbox_rect):
                 if axis == 'horizontal':
                     # Left collision
@@ -155,7 +158,7 @@ class Player(pygame.sprite.Sprite):
 
     def semi_collision(self):
         if not self.timers['platform skip'].active:
-            for sprite in self.semi_collision_sprites:
+            for sprite in self.semi_collision_sprites.near(self.hitbox_rect):
                 if sprite.rect.colliderect(self.hitbox_rect):
                     # Bottom collision
                     if (self.hitbox_rect.bottom >= sprite.rect.top) and (int(self.old_rect.bottom) <= sprite.old_rect.top):
@@ -164,11 +167,6 @@ class Player(pygame.sprite.Sprite):
                             self.direction.y = 0
 
 
-    def update_timers(self):
-        for timer in self.timers.values():
-            timer.update()
-
-
     def animate(self, dt):
         self.frames_index += ANIMATION_SPEED * dt
         # Attack reset after 1 cycle
@@ -178,8 +176,8 @@ class Player(pygame.sprite.Sprite):
             self.attacking = False
 
         # Other
-        self.image = self.frames[self.state][int(self.frames_index) % len(self.frames[self.state])]
-        self.image = self.image if self.facing_right else pygame.transform.flip(self.image, True, False)
+        frames = self.frames[self.state] if self.facing_right else self.left_frames[self.state]
+        self.image = frames[int(self.frames_index) % len(frames)]
 
 
     def get_state(self):
@@ -205,16 +203,13 @@ class Player(pygame.sprite.Sprite):
 
 
     def flicker(self):
-        if self.timers['hit'].active and sin(pygame.time.get_ticks() * 200) >= 0:
-            white_mask = pygame.mask.from_surface(self.image)
-            white_surf = white_mask.to_surface()
-            white_surf.set_colorkey('black')
-            self.image = white_surf
+        if self.timers['hit'].active and sin(scheduler.time * 200) >= 0:
+            frames = self.hit_frames[self.state] if self.facing_right else self.left_hit_frames[self.state]
+            self.image = frames[int(self.frames_index) % len(frames)]
 
     def update(self, dt):
         # General update
         self.old_rect = self.hitbox_rect.copy()
-        self.update_timers()
 
         # Input and movement
         self.input()
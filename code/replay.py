@@ -0,0 +1,101 @@
+import struct
+import zlib
+
+from settings import *
+from controls import KeyState
+from array import array
+
+# Recorded runs: the tracked keys of every tick, one bit per key
+TRACKED_KEYS = (pygame.K_RIGHT, pygame.K_d, pygame.K_LEFT, pygame.K_a, pygame.K_DOWN, pygame.K_s,
+                pygame.K_UP, pygame.K_w, pygame.K_f, pygame.K_SPACE)
+MAGIC = b'RPLY'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')  # Magic, version, tick rate, random seed, then the zlib compressed masks
+SEED_RANGE = range(2 ** 32)  # Seeds the header can store
+
+
+def key_mask(keys):
+    return sum(1 << bit for bit, key in enumerate(TRACKED_KEYS) if keys[key])
+
+
+def mask_keys(mask):
+    return KeyState({key for bit, key in enumerate(TRACKED_KEYS) if mask >> bit & 1})
+
+
+def save_replay(path, seed, masks):
+    masks = array('H', masks)
+    if sys.byteorder != 'little':
+        masks.byteswap()
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, TICK_RATE, seed))
+        file.write(zlib.compress(masks.tobytes()))
+
+
+def load_replay(path):
+    with open(path, 'rb') as file:
+        content = file.read()
+    magic, version, tick_rate, seed = HEADER.unpack_from(content)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'{path} is not a replay file')
+    if tick_rate != TICK_RATE:
+        raise ValueError(f'{path} was recorded at {tick_rate} ticks per second, the game runs at {TICK_RATE}')
+    masks = array('H')
+    masks.frombytes(zlib.decompress(content[HEADER.size:]))
+    if sys.byteorder != 'little':
+        masks.byteswap()
+    return seed, masks
+
+
+class Recorder:
+    def __init__(self, provider, path, seed):
+        self.provider = provider
+        self.path = path
+        self.seed = seed
+        self.masks = array('H')
+
+    def read(self):
+        mask = key_mask(self.provider.read())
+        self.masks.append(mask)
+        return mask_keys(mask)  # The game sees exactly what will be replayed
+
+    def save(self):
+        save_replay(self.path, self.seed, self.masks)
+
+
+class Replay:
+    def __init__(self, masks):
+        self.masks = masks
+        self.tick = 0
+
+    @property
+    def finished(self):
+        return self.tick >= len(self.masks)
+
+    def read(self):
+        mask = self.masks[self.tick] if not self.finished else 0
+        self.tick += 1
+        return mask_keys(mask)
+
+
+def percentile(values, fraction):
+    # Nearest rank on the sorted values
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0
+
+
+class FrameTimes:
+    def __init__(self, path):
+        self.path = path
+        self.times = array('f')  # In ms
+
+    def add(self, time):
+        self.times.append(time)
+
+    def summary(self):
+        times = sorted(self.times)
+        return {'frames': len(times), 'p50': percentile(times, 0.5), 'p95': percentile(times, 0.95),
+                'p99': percentile(times, 0.99), 'max': times[-1] if times else 0}
+
+    def save(self):
+        # One frame per line, easy to load anywhere
+        with open(self.path, 'w') as file:
+            file.writelines(f'{time:.3f}\n' for time in self.times)
@@ -5,6 +5,40 @@ WINDOW_WIDTH, WINDOW_HEIGHT = 1280, 720
 TILE_SIZE = 64
 ANIMATION_SPEED = 4
 
+# Rendering
+VIEWPORT_CULLING = True  # Only draw the sprites in the tile cells seen by the camera
+STATIC_CHUNKS = True  # Pre-render the tile layers into large surfaces
+CHUNK_SIZE = 1024
+DIRTY_RECTS = False  # Only push the parts of the screen that changed to the window
+
+# Simulation
+TICK_RATE = 60  # Fixed updates per second, whatever the frame rate
+MAX_FRAME_TIME = 0.25  # Real time caught up at most per frame, in seconds
+
+# Frame pacing
+TARGET_FPS = 60  # Frames drawn per second at most, 0 for no limit
+IDLE_FPS = 20  # While the stage waits for the player, like the overworld icon standing on a node
+ADAPTIVE_DETAIL = False  # Skip cosmetic work (small clouds, heart animations) while frames run over budget
+DETAIL_RECOVERY = 0.75  # Full detail again once frames take less than this part of the budget
+
+# UI
+HEART_LIMIT = 20  # Above that the health is shown as one heart and 'x N'
+HEART_ANIMATION_INTERVAL = 1000  # ms between two idle heart animations
+TEXT_CACHE_SIZE = 128  # Rendered strings kept by the UI
+
+# Profiler
+PROFILER_ENABLED = False
+PROFILER_HISTORY = 300  # Frames kept and graphed
+PROFILER_KEY = pygame.K_F3  # Show/hide the overlay
+PROFILER_DUMP_KEY = pygame.K_F4  # Save the kept frames
+PROFILER_FILE = 'profile.json'
+
+# Assets
+# Images shared by every stage, packed by atlas.py and decoded at startup
+# The tilesets and map objects are loaded with each map instead
+SHARED_IMAGE_FOLDERS = ['effects', 'enemies', 'items', 'level', 'overworld', 'player', 'ui', 'objects/boat']
+MAP_CACHE_SIZE = 2  # Levels kept in memory
+
 # Layers
 Z_LAYERS = {
     'bg': 0,
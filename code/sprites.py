@@ -3,6 +3,7 @@ import pygame.sprite
 from settings import *
 from math import sin, cos, radians
 from random import randint
+from support import flip_frames
 
 class Sprite(pygame.sprite.Sprite):
     def __init__(self, pos, surf = pygame.Surface((TILE_SIZE, TILE_SIZE)), groups = None, z = Z_LAYERS['main']):
@@ -109,7 +110,8 @@ class MovingSprite(AnimatedSprite):
 
         self.animate(dt)
         if self.flip:
-            self.image = pygame.transform.flip(self.image, self.reverse['x'], self.reverse['y'])
+            frames = flip_frames(self.frames, self.reverse['x'], self.reverse['y'])
+            self.image = frames[int(self.frame_index % len(frames))]
 
 
 class Spike(Sprite):
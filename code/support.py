@@ -1,39 +1,107 @@
 import pygame
+import json
 
 from settings import *
-from os.path import join
-from os import walk
+from os.path import join, normpath, exists
+from os import walk, listdir, cpu_count
+from concurrent.futures import ThreadPoolExecutor
+
+decoded_images = {}  # image path -> surface, filled ahead of time by preload_images
+
+# Packed sheets built by atlas.py, the import functions below look here before opening a file
+atlas_frames = {}  # image path -> subsurface of its sheet
+atlas_folders = {}  # folder path -> (sub folders, image names)
+
+
+def load_atlas(*path):
+    index_path = join(*path, 'atlas.json')
+    if not exists(index_path):
+        return False
+    with open(index_path) as file:
+        index = json.load(file)
+    sheets = [load_image(join(*path, sheet_name)) for sheet_name in index['sheets']]
+    graphics_path = join(*path, '..')
+    for name, (sheet, x, y, width, height) in index['frames'].items():
+        atlas_frames[normpath(join(graphics_path, *name.split('/')))] = sheets[sheet].subsurface((x, y, width, height))
+    for name, folder in index['folders'].items():
+        atlas_folders[normpath(join(graphics_path, *name.split('/')))] = folder
+    return True
+
+
+def load_image(full_path):
+    if normpath(full_path) in decoded_images:
+        return decoded_images[normpath(full_path)]
+    if normpath(full_path) in atlas_frames:
+        return atlas_frames[normpath(full_path)]
+    return pygame.image.load(full_path).convert_alpha()
+
+
+def asset_paths(*path):
+    # The sheets if the atlas was built, every shared image otherwise
+    atlas_path = join(*path, 'atlas')
+    if exists(join(atlas_path, 'atlas.json')):
+        return [join(atlas_path, name) for name in listdir(atlas_path) if name.endswith('.png')]
+    return [join(folder_path, name)
+            for shared_folder in SHARED_IMAGE_FOLDERS
+            for folder_path, _, names in walk(join(*path, shared_folder))
+            for name in names if name.endswith('.png')]
+
+
+def preload_images(paths, progress = None):
+    # Decode the files on a thread pool (pygame lets go of the GIL while decoding)
+    paths = [normpath(path) for path in paths if normpath(path) not in decoded_images]
+    surfs = []
+    with ThreadPoolExecutor(max_workers = cpu_count()) as executor:
+        for surf in executor.map(pygame.image.load, paths):
+            surfs.append(surf)
+            if progress and (len(surfs) % 32 == 0 or len(surfs) == len(paths)):  # Not every image, drawing isn't free
+                progress(len(surfs), len(paths))
+    # Converting needs the display, so it stays on the main thread, in one go
+    for path, surf in zip(paths, surfs):
+        decoded_images[path] = surf.convert_alpha()
+
+
+def walk_images(path):
+    # Same as os.walk, answered by the atlas index when the folder was packed
+    folder_path = normpath(path)
+    if folder_path not in atlas_folders:
+        yield from walk(path)
+        return
+    sub_folders, image_names = atlas_folders[folder_path]
+    yield folder_path, sub_folders, image_names
+    for sub_folder in sub_folders:
+        yield from walk_images(join(folder_path, sub_folder))
 
 
 def import_image(*path, alpha=True, format='png'):
     full_path = join(*path) + f'.{format}'
-    surf = pygame.image.load(full_path).convert_alpha() if alpha else pygame.image.load(full_path).convert()
+    surf = load_image(full_path) if alpha else pygame.image.load(full_path).convert()
     return surf
 
 
 def import_folder(*path):
     frames = []
-    for folder_path, sub_folders, image_names in walk(join(*path)):
+    for folder_path, sub_folders, image_names in walk_images(join(*path)):
         for image_name in sorted(image_names, key=lambda name: int(name.split('.')[0])):
             full_path = join(folder_path, image_name)
-            surf = pygame.image.load(full_path).convert_alpha()
+            surf = load_image(full_path)
             frames.append(surf)
     return frames
 
 
 def import_folder_dict(*path):
 	frame_dict = {}
-	for folder_path, _, image_names in walk(join(*path)):
+	for folder_path, _, image_names in walk_images(join(*path)):
 		for image_name in image_names:
 			full_path = join(folder_path, image_name)
-			surface = pygame.image.load(full_path).convert_alpha()
+			surface = load_image(full_path)
 			frame_dict[image_name.split('.')[0]] = surface
 	return frame_dict
 
 
 def import_sub_folders(*path):
     frames = {}
-    for _, sub_folders, _ in walk(join(*path)):
+    for _, sub_folders, _ in walk_images(join(*path)):
         if sub_folders:
             for sub_folder in sub_folders:
                 frames[sub_folder] = import_folder(*path, sub_folder)
@@ -54,3 +122,47 @@ def import_tilemap(cols, rows, *path):
             frames[(col, row)] = cutout_surf
     return frames
 
+
+tiled_surfaces = {}  # (surface, width, height) -> surface repeated over that size
+
+
+def tile_surface(surf, width, height):
+    # Made once, the same backgrounds come back each time a level or the overworld is built
+    key = (surf, width, height)
+    if key not in tiled_surfaces:
+        tiled_surf = pygame.Surface((width, height), pygame.SRCALPHA)
+        for x in range(0, width, surf.get_width()):
+            for y in range(0, height, surf.get_height()):
+                tiled_surf.blit(surf, (x, y))
+        tiled_surfaces[key] = tiled_surf
+    return tiled_surfaces[key]
+
+
+flipped_frames = {}  # (id(frames), flip_x, flip_y) -> (frames, flipped frames)
+
+
+def flip_frames(frames, flip_x = True, flip_y = False):
+    # Mirrored frames are made once and shared, instead of flipping an image every frame
+    if not flip_x and not flip_y:
+        return frames
+    key = (id(frames), flip_x, flip_y)
+    if key not in flipped_frames:
+        # The original list is kept alive as well so its id can't be reused
+        flipped_frames[key] = (frames, [pygame.transform.flip(frame, flip_x, flip_y) for frame in frames])
+    return flipped_frames[key][1]
+
+
+silhouettes = {}  # surface -> white version of it
+
+
+def silhouette(surf):
+    # White flash of a frame, made once per frame so any sprite can flash when hit
+    if surf not in silhouettes:
+        white_surf = pygame.mask.from_surface(surf).to_surface()
+        white_surf.set_colorkey('black')
+        silhouettes[surf] = white_surf
+    return silhouettes[surf]
+
+
+def silhouette_frames(frames):
+    return [silhouette(frame) for frame in frames]
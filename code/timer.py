@@ -1,4 +1,37 @@
-from pygame.time import get_ticks
+from settings import *
+from math import ceil
+from heapq import heappush, heappop
+from itertools import count
+from weakref import ref
+
+
+class TimerScheduler:
+    def __init__(self):
+        # Counted in whole ticks, a float time would add up rounding errors and move the deadlines
+        self.ticks = 0
+        self.time = 0  # The same in ms
+        self.deadlines = []  # Min-heap of (deadline tick, order, timer)
+        self.counter = count()
+
+    def schedule(self, timer):
+        timer.order = next(self.counter)
+        # Weak reference so the timers of a finished level don't stay alive here
+        deadline = self.ticks + ceil(timer.duration * TICK_RATE / 1000)
+        heappush(self.deadlines, (deadline, timer.order, ref(timer)))
+
+    def update(self):
+        # Once per tick of the simulation
+        self.ticks += 1
+        self.time = self.ticks * 1000 / TICK_RATE
+        while self.deadlines and self.deadlines[0][0] <= self.ticks:
+            _, order, timer_ref = heappop(self.deadlines)
+            timer = timer_ref()
+            # Skip the timers deactivated, restarted or deleted since they were scheduled
+            if timer and timer.active and timer.order == order:
+                timer.expire()
+
+
+scheduler = TimerScheduler()
 
 
 class Timer:
@@ -8,10 +41,12 @@ class Timer:
         self.start_time = 0
         self.active = False
         self.repeat = repeat
+        self.order = None
 
     def activate(self):
         self.active = True
-        self.start_time = get_ticks()
+        self.start_time = scheduler.time
+        scheduler.schedule(self)
 
     def deactivate(self):
         self.active = False
@@ -19,9 +54,11 @@ class Timer:
         if self.repeat:
             self.activate()
 
+    def expire(self):
+        if self.func:
+            self.func()
+        self.deactivate()
+
     def update(self):
-        current_time = get_ticks()
-        if current_time - self.start_time >= self.duration:
-            if self.func and self.start_time != 0:
-                self.func()
-            self.deactivate()
+        # Nothing to poll anymore, the scheduler fires the timers
+        pass
@@ -1,76 +1,143 @@
 from settings import *
-from sprites import AnimatedSprite
 from random import randint
 from timer import Timer
 
+class GlyphCache:
+    def __init__(self, font, color):
+        # Every character is rendered once, the strings are put together from them
+        self.font = font
+        self.color = color
+        self.glyphs = {}  # character -> surface
+        self.texts = {}  # string -> surface
+
+    def render(self, text):
+        if text not in self.texts:
+            if len(self.texts) >= TEXT_CACHE_SIZE:
+                self.texts.clear()
+            for char in text:
+                if char not in self.glyphs:
+                    self.glyphs[char] = self.font.render(char, False, self.color)
+            text_surf = pygame.Surface((sum(self.glyphs[char].get_width() for char in text), self.font.get_height()), pygame.SRCALPHA)
+            x = 0
+            for char in text:
+                text_surf.blit(self.glyphs[char], (x, 0))
+                x += self.glyphs[char].get_width()
+            self.texts[text] = text_surf
+        return self.texts[text]
+
+
 class UI():
     def __init__(self, font, frames):
         self.display_surface = pygame.display.get_surface()
-        self.sprites = pygame.sprite.Group()
         self.font = font
+        self.text = GlyphCache(font, 'White')
 
-        # Health
+        # Health, every heart drawn once on a single surface
         self.heart_frames = frames['heart']
-        self.heart_surf_width = self.heart_frames[0].get_width()
+        self.heart_width, self.heart_height = self.heart_frames[0].get_size()
         self.heart_padding = 5
+        # As tall as the text of the compact display, the hearts in the middle
+        self.hearts_surf = pygame.Surface(((self.heart_width + self.heart_padding) * HEART_LIMIT, max(self.heart_height, self.font.get_height())), pygame.SRCALPHA)
+        self.heart_y = (self.hearts_surf.get_height() - self.heart_height) // 2
+        self.health = 0
+        self.compact = False  # One heart and 'x N'
+
+        # Heart animations, one at a time from a single timer
+        self.heart_animations = {}  # heart index -> frame index
+        self.heart_timer = Timer(HEART_ANIMATION_INTERVAL, self.animate_random_heart, True)
+        self.low_detail = False  # Set by the game with ADAPTIVE_DETAIL
+        self.heart_timer.activate()
 
         # Coins
         self.coin_surf = frames['coin']
         self.coin_amount = 0
-        self.coin_timer = Timer(1000)
-        pass
-
-    def create_hearts(self, amount):
-        # First delete previous hearts:
-        for sprite in self.sprites:
-            sprite.kill()
-        # Then create the new one
-        for heart in range(amount):
-            Heart(pos =  ( 10+ heart * (self.heart_padding + self.heart_surf_width), 10),
-                  frames = self.heart_frames,
-                  groups = self.sprites
-                  )
+        self.coin_timer = Timer(1000, self.refresh)  # The coins disappear when it runs out
+
+        # Everything above on one surface, put together again only after a change
+        self.hud_surf = pygame.Surface((10 + self.hearts_surf.get_width(), 34 + self.font.get_height()), pygame.SRCALPHA)
+        self.hud_changed = True
+        self.dirty_rects = []  # Parts of the screen changed by the last draw
+
+    def reset(self):
+        # Nothing shown or animated, like a new UI
+        self.hearts_surf.fill((0, 0, 0, 0))
+        self.health = 0
+        self.compact = False
+        self.heart_animations.clear()
+        self.heart_timer.activate()
+        self.coin_amount = 0
+        self.coin_timer.deactivate()
+        self.refresh()
+
+    def draw_heart(self, index, frame_index = 0):
+        x = index * (self.heart_width + self.heart_padding)
+        self.hearts_surf.fill((0, 0, 0, 0), (x, self.heart_y, self.heart_width, self.heart_height))
+        if frame_index is not None:
+            self.hearts_surf.blit(self.heart_frames[frame_index], (x, self.heart_y))
+        self.hud_changed = True
+
+    def show_health(self, amount):
+        # Only the hearts that appeared or disappeared are redrawn
+        if amount > HEART_LIMIT:
+            self.hearts_surf.fill((0, 0, 0, 0))
+            self.draw_heart(0)
+            text_surf = self.text.render(f'x {amount}')
+            self.hearts_surf.blit(text_surf, text_surf.get_frect(midleft = (self.heart_width + self.heart_padding, self.heart_y + self.heart_height / 2)))
+            shown = 1
+        else:
+            if self.compact:
+                self.hearts_surf.fill((0, 0, 0, 0))
+                self.health = 0
+            for index in range(min(self.health, amount), max(self.health, amount)):
+                self.draw_heart(index, 0 if index < amount else None)
+            shown = amount
+        self.heart_animations = {index: frame_index for index, frame_index in self.heart_animations.items() if index < shown}
+        self.health = amount
+        self.compact = amount > HEART_LIMIT
+
+    def animate_random_heart(self):
+        shown = 1 if self.compact else self.health
+        if shown > 0:
+            index = randint(0, shown - 1)  # Drawn anyway, a replay stays the same
+            if not self.low_detail:
+                self.heart_animations[index] = 0
 
     def display_text(self):
         if self.coin_timer.active:
             # Text
-            text_surf = self.font.render(str(self.coin_amount), False, 'White')
+            text_surf = self.text.render(str(self.coin_amount))
             text_rect = text_surf.get_frect(topleft = (16, 34))
-            self.display_surface.blit(text_surf, text_rect)
+            self.hud_surf.blit(text_surf, text_rect)
 
             # Coin
             coin_rect = self.coin_surf.get_frect(center = text_rect.midright).move(10,0)
-            self.display_surface.blit(self.coin_surf, coin_rect)
+            self.hud_surf.blit(self.coin_surf, coin_rect)
 
     def show_coins(self, amount):
         self.coin_amount = amount
         self.coin_timer.activate()
+        self.refresh()
 
-    def update(self, dt):
-        self.coin_timer.update()
-        self.sprites.update(dt)
-        self.sprites.draw(self.display_surface)
-        self.display_text()
-
-
-class Heart(AnimatedSprite):
-    def __init__(self, pos, frames, groups):
-        super().__init__(pos, frames, groups)
-
-        # Occasionally animate
-        self.active = False
-
-    def animate(self, dt):
-        self.frame_index += ANIMATION_SPEED * dt
-        if self.frame_index < len(self.frames):
-            self.image = self.frames[int(self.frame_index)]
-        else:
-            self.active = False
-            self.frame_index = 0
+    def refresh(self):
+        self.hud_changed = True
 
     def update(self, dt):
-        if self.active:
-            self.animate(dt)
-        else:
-            if randint(0,2000) == 1:
-                self.active = True
+        for index, frame_index in list(self.heart_animations.items()):
+            next_index = frame_index + ANIMATION_SPEED * dt
+            if next_index >= len(self.heart_frames):
+                del self.heart_animations[index]
+                self.draw_heart(index)
+            else:
+                if int(next_index) != int(frame_index):
+                    self.draw_heart(index, int(next_index))
+                self.heart_animations[index] = next_index
+
+    def draw(self):
+        self.dirty_rects = []
+        if self.hud_changed:
+            self.hud_surf.fill((0, 0, 0, 0))
+            self.hud_surf.blit(self.hearts_surf, (10, 10 - self.heart_y))
+            self.display_text()
+            self.hud_changed = False
+            self.dirty_rects.append(self.hud_surf.get_rect())
+        self.display_surface.blit(self.hud_surf, (0, 0))